@@ -0,0 +1,66 @@
+"""Incremental MP3 encoding of float32 blocks for streamed mix responses.
+
+Each rendered block is converted to interleaved 16-bit PCM and fed to an
+in-process LAME encoder, which hands back whatever complete MP3 frames it
+has, so bytes can go out on the wire while later blocks are still rendering.
+"""
+import io
+import os
+import numpy as np
+import soundfile as sf
+from render_quality import MP3_BITRATE
+
+try:
+    import lameenc
+    MP3_STREAMING_AVAILABLE = True
+except ImportError:
+    MP3_STREAMING_AVAILABLE = False
+
+MP3_QUALITY = int(os.getenv("MP3_QUALITY", "2"))  # LAME: 2 = high quality, 7 = fastest
+# Samples per rendered block; a multiple of the 1152-sample MP3 frame (~0.21s at 44.1 kHz)
+RENDER_BLOCK_SIZE = int(os.getenv("RENDER_BLOCK_SIZE", str(1152 * 8)))
+
+
+class Mp3StreamEncoder:
+    def __init__(self, sample_rate: int, channels: int, bitrate: int = MP3_BITRATE, quality: int = MP3_QUALITY):
+        if not MP3_STREAMING_AVAILABLE:
+            raise ImportError("lameenc is required for streamed MP3 output")
+        if channels not in (1, 2):
+            raise ValueError(f"MP3 supports 1 or 2 channels, got {channels}")
+        self._encoder = lameenc.Encoder()
+        self._encoder.set_bit_rate(bitrate)
+        self._encoder.set_in_sample_rate(sample_rate)
+        self._encoder.set_channels(channels)
+        self._encoder.set_quality(quality)
+
+    def encode(self, block: np.ndarray) -> bytes:
+        """Encode one (channels, n) float32 block; may return b"" while LAME buffers"""
+        pcm = (np.clip(block, -1.0, 1.0) * 32767).astype("<i2")
+        return bytes(self._encoder.encode(pcm.T.tobytes()))
+
+    def flush(self) -> bytes:
+        return bytes(self._encoder.flush())
+
+
+def encode_mp3_stream(blocks, sample_rate: int, channels: int, bitrate: int = MP3_BITRATE):
+    """Yield MP3 bytes as each block of `blocks` is encoded"""
+    encoder = Mp3StreamEncoder(sample_rate, channels, bitrate)
+    for block in blocks:
+        data = encoder.encode(block)
+        if data:
+            yield data
+    tail = encoder.flush()
+    if tail:
+        yield tail
+
+
+def encode_audio(y: np.ndarray, sample_rate: int, fmt: str = "mp3", bitrate: int = MP3_BITRATE,
+                 block_size: int = RENDER_BLOCK_SIZE) -> bytes:
+    """Encode a whole (n,) or (channels, n) buffer into in-memory MP3 or WAV file bytes"""
+    y = np.atleast_2d(y)
+    if fmt == "mp3" and MP3_STREAMING_AVAILABLE:
+        blocks = (y[:, start:start + block_size] for start in range(0, y.shape[-1], block_size))
+        return b"".join(encode_mp3_stream(blocks, sample_rate, y.shape[0], bitrate))
+    buffer = io.BytesIO()
+    sf.write(buffer, y.T, sample_rate, format=fmt.upper())
+    return buffer.getvalue()
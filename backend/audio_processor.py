@@ -1,25 +1,240 @@
 import librosa
-import pyrubberband as pyrb
 import soundfile as sf
 import numpy as np
 import os
-from typing import Dict, Tuple, Optional
+from typing import Dict, Tuple, Optional, Union, Iterator
 import logging
-from pydub import AudioSegment
+from stem_cache import stem_cache
+from audio_cache import AudioBufferCache
+from stem_store import StemStore
+from mix_engine import MixPlan, PlacedTrack, place_with_crossfade
+from mix_graph import GraphPlan, MixGraph, track_time_window
+from audio_encoder import RENDER_BLOCK_SIZE, encode_audio, encode_mp3_stream
+from render_quality import MP3_BITRATE, MIX_TARGET_LUFS, MIX_MAX_GAIN_DB, LIMITER_CEILING_DB, RenderQuality
+from harmonic import harmonic_suggestions
+from stretch import StretchBackend, get_stretch_backend
+from effects import EffectsChain, Limiter
+import loudness
 
 logger = logging.getLogger(__name__)
 
+# Extra audio decoded around a time window and discarded: covers MP3 decoder
+# priming after a seek and keeps resampler edge effects out of the window
+WINDOW_PREROLL_SECONDS = 0.1
+WINDOW_POSTROLL_SECONDS = 0.05
+# Input stretched past the end of a mix region and discarded
+STRETCH_REGION_MARGIN_SECONDS = 0.1
+
 class RiddimAudioProcessor:
-    def __init__(self, sample_rate: int = 44100):
+    def __init__(self, sample_rate: int = 44100, buffer_cache: Optional[AudioBufferCache] = None,
+                 stretch_backend: Optional[Union[str, StretchBackend]] = None,
+                 mp3_bitrate: int = MP3_BITRATE, normalize: bool = True,
+                 stem_store: Optional[StemStore] = None):
         self.sr = sample_rate
+        self.mp3_bitrate = mp3_bitrate
+        # Gain mixes toward MIX_TARGET_LUFS from stem loudness and limit them while rendering
+        self.normalize = normalize
         self.temp_dir = "temp_audio"
         os.makedirs(self.temp_dir, exist_ok=True)
+        # Decoded audio shared by analysis, processing and mixing so each file is decoded once
+        self.buffer_cache = buffer_cache or AudioBufferCache()
+        # Catalog stems are sliced from memory-mapped float32 files instead of decoded
+        self.stem_store = stem_store
+        # Time-stretch/pitch-shift engine: a backend name from stretch.STRETCH_BACKENDS or an instance
+        if not isinstance(stretch_backend, StretchBackend):
+            stretch_backend = get_stretch_backend(stretch_backend)
+        self.stretch_backend = stretch_backend
+        logger.info(f"Using '{stretch_backend.name}' stretch backend")
+    
+    @classmethod
+    def for_quality(cls, quality: RenderQuality, buffer_cache: Optional[AudioBufferCache] = None,
+                    stem_store: Optional[StemStore] = None):
+        """A processor rendering at a RenderQuality tier; tiers can share one buffer cache and stem store"""
+        return cls(sample_rate=quality.sample_rate, buffer_cache=buffer_cache,
+                   stretch_backend=quality.stretch_backend, mp3_bitrate=quality.mp3_bitrate,
+                   normalize=quality.normalize, stem_store=stem_store)
+    
+    def _source_key(self, source: str):
+        """Identity of an audio source for the decode cache"""
+        if source.startswith('http'):
+            return source
+        # Include mtime/size so a reused temp path never returns stale audio
+        st = os.stat(source)
+        return (os.path.realpath(source), st.st_mtime_ns, st.st_size)
+    
+    def _in_stem_store(self, source: str) -> bool:
+        """Whether `source` is sliced from the stem store; a catalog stem not stored yet is
+        queued for a background decode and read the regular (windowed) way meanwhile"""
+        if self.stem_store is None or not self.stem_store.accepts(source):
+            return False
+        if self.stem_store.stored(source):
+            return True
+        self.stem_store.warm_later(source)
+        return False
+    
+    def load_audio(self, source: str, offset: Optional[float] = None,
+                   duration: Optional[float] = None, mono: bool = True) -> Tuple[np.ndarray, int]:
+        """Decode a local path or URL at self.sr, memoized by (source, sr, offset, duration).
+        
+        Returned buffers are read-only and shared between callers; copy before modifying in place.
+        """
+        if self._in_stem_store(source):
+            end = None if duration is None else (offset or 0.0) + duration
+            return self.stem_store.window(source, offset or 0.0, end, mono, self.sr)
+        key = (self._source_key(source), self.sr, offset, duration, mono)
+        
+        def decode():
+            path = stem_cache.fetch(source) if source.startswith('http') else source
+            return librosa.load(path, sr=self.sr, mono=mono, offset=offset or 0.0, duration=duration)
+        
+        return self.buffer_cache.get_or_compute(key, decode)
+    
+    def probe_source(self, source: str) -> Tuple[int, int]:
+        """(length in samples at self.sr, channels) of a source without decoding it, memoized"""
+        if self._in_stem_store(source):
+            y = self.stem_store.load(source)
+            return int(y.shape[-1] * self.sr / self.stem_store.sample_rate), y.shape[0]
+        key = (self._source_key(source), self.sr, "probe")
+        
+        def probe():
+            path = stem_cache.fetch(source) if source.startswith('http') else source
+            try:
+                info = sf.info(path)
+                return int(info.frames * self.sr / info.samplerate), info.channels
+            except RuntimeError:  # sf.LibsndfileError: not readable by libsndfile
+                return int(librosa.get_duration(path=path) * self.sr), 2
+        
+        return self.buffer_cache.get_or_compute(key, probe)
+    
+    def load_window(self, source: str, start: float = 0.0, end: Optional[float] = None,
+                    mono: bool = True) -> Tuple[np.ndarray, int]:
+        """Decode only [start, end) seconds of a source at self.sr, memoized.
+        
+        Seeks inside the file and decodes a short pre-roll (codec priming and
+        resampler warm-up) plus post-roll around the window, so cost scales with
+        the window length rather than the song length. Falls back to librosa's
+        offset/duration loading for formats libsndfile can't seek. Catalog stems
+        in the stem store are sliced from their memory-mapped file instead.
+        """
+        start = max(0.0, float(start or 0.0))
+        end = None if end is None else float(end)
+        if end is not None and end <= start:
+            raise ValueError(f"Invalid time window: start={start}, end={end}")
+        if self._in_stem_store(source):
+            return self.stem_store.window(source, start, end, mono, self.sr)
+        key = (self._source_key(source), self.sr, "window", start, end, mono)
+        
+        def decode():
+            path = stem_cache.fetch(source) if source.startswith('http') else source
+            try:
+                return self._decode_window(path, start, end, mono)
+            except RuntimeError as e:  # sf.LibsndfileError: format not readable/seekable
+                logger.info(f"Seeking decode unavailable for {path} ({e}); using librosa offset/duration")
+                duration = None if end is None else end - start
+                return librosa.load(path, sr=self.sr, mono=mono, offset=start, duration=duration)
+        
+        return self.buffer_cache.get_or_compute(key, decode)
+    
+    def _decode_window(self, path: str, start: float, end: Optional[float], mono: bool) -> Tuple[np.ndarray, int]:
+        with sf.SoundFile(path) as f:
+            native_sr = f.samplerate
+            read_start = max(0.0, start - WINDOW_PREROLL_SECONDS)
+            first_frame = int(read_start * native_sr)
+            if end is None:
+                last_frame = f.frames
+            else:
+                last_frame = min(f.frames, int((end + WINDOW_POSTROLL_SECONDS) * native_sr))
+            f.seek(first_frame)
+            data = f.read(max(0, last_frame - first_frame), dtype='float32', always_2d=True)
+        
+        y = data.mean(axis=1) if mono else data.T
+        if native_sr != self.sr:
+            y = librosa.resample(y, orig_sr=native_sr, target_sr=self.sr)
+        
+        # Drop the pre-roll and trim to the exact window length at the target rate
+        offset = int(round((start - read_start) * self.sr))
+        length = None if end is None else int(round((end - start) * self.sr))
+        y = y[..., offset:] if length is None else y[..., offset:offset + length]
+        return np.ascontiguousarray(y, dtype=np.float32), self.sr
+    
+    def _load_stem(self, stem_file: str, time_window: Optional[Dict] = None, mono: bool = True) -> np.ndarray:
+        # Decode only the requested time window, if specified
+        if time_window:
+            return self.load_window(stem_file, time_window.get("start", 0), time_window.get("end"), mono=mono)[0]
+        return self.load_audio(stem_file, mono=mono)[0]
+    
+    def _stack_stems(self, buffers: list) -> np.ndarray:
+        """Copy stem buffers into one preallocated (n_stems, [channels,] n_samples) float32 array.
+        
+        Stems are truncated to the shortest one; mono stems are broadcast when others are stereo.
+        """
+        length = min(b.shape[-1] for b in buffers)
+        inner_shape = max((b.shape[:-1] for b in buffers), key=len)
+        stack = np.empty((len(buffers),) + inner_shape + (length,), dtype=np.float32)
+        for i, b in enumerate(buffers):
+            stack[i] = b[..., :length]
+        return stack
+    
+    def _sum_stack(self, stack: np.ndarray, gains: Optional[list] = None) -> np.ndarray:
+        """Sum a stem stack with per-stem gains in a single reduction"""
+        if gains is None:
+            return stack.sum(axis=0)
+        gains = np.asarray(gains, dtype=np.float32)
+        if gains.shape != (stack.shape[0],):
+            raise ValueError(f"Expected {stack.shape[0]} stem gains, got {len(gains)}")
+        return np.tensordot(gains, stack, axes=1)
+    
+    def load_track_bus(self, stems: list, time_window: Optional[Dict] = None,
+                       gains: Optional[list] = None, mono: bool = True) -> np.ndarray:
+        """Sum a track's stems into one "track bus" buffer, memoized.
+        
+        Cached by (stem set, window, gains), so re-renders that only change delays,
+        crossfades or effects skip decoding and summing entirely.
+        """
+        window = (float(time_window.get("start", 0)), time_window.get("end")) if time_window else None
+        gains_key = tuple(float(g) for g in gains) if gains is not None else None
+        key = ("bus", tuple(self._source_key(stem) for stem in stems), self.sr, window, gains_key, mono)
+        
+        def build():
+            buffers = [self._load_stem(stem, time_window, mono) for stem in stems]
+            return (self._sum_stack(self._stack_stems(buffers), gains),)
+        
+        return self.buffer_cache.get_or_compute(key, build)[0]
+    
+    def measure_loudness(self, source: str, time_window: Optional[Dict] = None, mono: bool = True) -> float:
+        """Integrated loudness (LUFS) of a source or its time window, memoized.
+        
+        Fallback for stems without stored loudness; measures the same decoded
+        buffer the render uses, so it costs one filter pass and no extra decode.
+        """
+        window = (float(time_window.get("start", 0)), time_window.get("end")) if time_window else None
+        key = ("loudness", self._source_key(source), self.sr, window, mono)
+        
+        def measure():
+            return (loudness.integrated_loudness(self._load_stem(source, time_window, mono), self.sr),)
+        
+        return self.buffer_cache.get_or_compute(key, measure)[0]
+    
+    def _track_loudness(self, stems: list, levels: Optional[list], time_window: Optional[Dict] = None,
+                        gains: Optional[list] = None, mono: bool = True) -> float:
+        """Estimated loudness of a track's summed stems from stored levels, measuring any that are unknown"""
+        levels = levels or [None] * len(stems)
+        levels = [
+            level if level is not None else self.measure_loudness(stem, time_window, mono)
+            for stem, level in zip(stems, levels)
+        ]
+        return loudness.sum_loudness(levels, gains)
+    
+    def _limited(self, effects: Optional[EffectsChain] = None) -> EffectsChain:
+        """Effects chain ending in the streaming peak limiter"""
+        chain = effects.effects if effects else []
+        return EffectsChain(chain + [Limiter(self.sr, ceiling_db=LIMITER_CEILING_DB)])
     
     def analyze_audio(self, audio_file: str) -> Dict:
         """Use librosa for comprehensive audio analysis"""
         try:
             logger.info(f"Analyzing audio file: {audio_file}")
-            y, sr = librosa.load(audio_file, sr=self.sr)
+            y, sr = self.load_audio(audio_file)
             
             # Beat detection and tempo analysis
             tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
@@ -30,6 +245,8 @@ class RiddimAudioProcessor:
             # Energy and loudness
             rms = librosa.feature.rms(y=y)[0]
             energy = np.mean(rms)
+            # True peak (a 4x oversampled pass) is measured only at ingest: no mix path reads it
+            loudness_lufs = loudness.integrated_loudness(y, sr)
             
             # Duration
             duration = librosa.get_duration(y=y, sr=sr)
@@ -39,7 +256,9 @@ class RiddimAudioProcessor:
                 "key": float(key),
                 "energy": float(energy),
                 "duration": float(duration),
-                "beats_count": len(beats)
+                "beats_count": len(beats),
+                "beat_times": librosa.frames_to_time(beats, sr=sr).tolist(),
+                "loudness_lufs": loudness_lufs,
             }
             
             logger.info(f"Analysis complete: {analysis}")
@@ -49,28 +268,25 @@ class RiddimAudioProcessor:
             logger.error(f"Audio analysis failed: {e}")
             raise
     
+    def process_buffer(self, y: np.ndarray, tempo_factor: float = 1.0, pitch_semitones: float = 0.0,
+                       effects: Optional[Dict] = None) -> np.ndarray:
+        """Time-stretch, pitch-shift and apply effects to a buffer in memory"""
+        y = self.stretch_and_shift(y, tempo_factor, pitch_semitones)
+        if effects:
+            y = self._apply_effects(y, self.sr, effects)
+        return y
+    
     def professional_process(self, audio_file: str, 
                            tempo_factor: float = 1.0,
                            pitch_semitones: float = 0.0,
                            effects: Optional[Dict] = None) -> str:
-        """Use pyrubberband for professional-quality audio processing"""
+        """Time-stretch, pitch-shift and apply effects; writes a WAV to temp_dir (see process_buffer for in memory)"""
         try:
             logger.info(f"Processing audio with tempo_factor={tempo_factor}, pitch_semitones={pitch_semitones}")
             
             # Load audio
-            y, sr = librosa.load(audio_file, sr=self.sr)
-            
-            # Apply tempo stretching
-            if tempo_factor != 1.0:
-                y = pyrb.time_stretch(y, sr, tempo_factor)
-            
-            # Apply pitch shifting
-            if pitch_semitones != 0.0:
-                y = pyrb.pitch_shift(y, sr, pitch_semitones)
-            
-            # Apply effects if specified
-            if effects:
-                y = self._apply_effects(y, sr, effects)
+            y, sr = self.load_audio(audio_file)
+            y = self.process_buffer(y, tempo_factor, pitch_semitones, effects)
             
             # Generate unique output filename
             base_name = os.path.splitext(os.path.basename(audio_file))[0]
@@ -85,44 +301,58 @@ class RiddimAudioProcessor:
             logger.error(f"Audio processing failed: {e}")
             raise
     
+    def stretch_and_shift(self, y: np.ndarray, tempo_factor: float = 1.0,
+                          pitch_semitones: float = 0.0) -> np.ndarray:
+        """Apply tempo and pitch changes in a single pass of the stretch backend"""
+        return self.stretch_backend.process(y, self.sr, tempo_factor, pitch_semitones)
+    
     def _apply_effects(self, y: np.ndarray, sr: int, effects: Dict) -> np.ndarray:
-        """Apply various audio effects using librosa"""
-        # Reverb effect
-        if effects.get("reverb"):
-            reverb_amount = effects["reverb"]
-            reverb_impulse = np.exp(-np.linspace(0, 5, int(sr * 0.1)))
-            y = np.convolve(y, reverb_impulse, mode='same') * (1 - reverb_amount) + y * reverb_amount
-        
-        # Delay effect
-        if effects.get("delay"):
-            delay_samples = int(sr * effects["delay"])
-            delay_signal = np.zeros_like(y)
-            delay_signal[delay_samples:] = y[:-delay_samples] * 0.5
-            y = y + delay_signal
+        """Run the buffer through the block effects chain (reverb, delay, EQ, filter sweep, compressor)"""
+        return EffectsChain.from_params(effects, sr).process_buffer(y)
+    
+    @staticmethod
+    def _beat_match_factors(tempo1: float, tempo2: float) -> Tuple[float, float]:
+        """Tempo factors taking both tracks to their average tempo (smoother than matching one to the other)"""
+        target_tempo = (tempo1 + tempo2) / 2
+        logger.info(f"Beat matching: {tempo1} and {tempo2} -> {target_tempo} BPM")
+        return target_tempo / tempo1, target_tempo / tempo2
+    
+    def _transform_region(self, y: np.ndarray, length: int, tempo_factor: float,
+                          pitch_semitones: float) -> np.ndarray:
+        """Stretch/shift only the input that produces the first `length` output samples"""
+        # A little extra input keeps the stretcher's end-of-buffer transient outside the region
+        needed = int(np.ceil(length * tempo_factor)) + int(STRETCH_REGION_MARGIN_SECONDS * self.sr)
+        return self.stretch_and_shift(y[..., :needed], tempo_factor, pitch_semitones)[..., :length]
+    
+    def _mix_region(self, y1: np.ndarray, y2: np.ndarray, track1_factor: float, track2_factor: float,
+                    pitch_semitones2: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """Transform two tracks that start together over the region until the shorter one ends"""
+        length = int(min(y1.shape[-1] / track1_factor, y2.shape[-1] / track2_factor))
+        y1 = self._transform_region(y1, length, track1_factor, 0.0)
+        y2 = self._transform_region(y2, length, track2_factor, pitch_semitones2)
+        length = min(y1.shape[-1], y2.shape[-1])
+        return y1[..., :length], y2[..., :length]
+    
+    def beat_match_buffers(self, y1: np.ndarray, y2: np.ndarray, tempo1: float, tempo2: float,
+                           pitch_semitones2: float = 0.0) -> Tuple[np.ndarray, np.ndarray]:
+        """Beat match two decoded tracks in memory, over the region they will be mixed in.
         
-        return y
+        Both tracks start together and the mix ends with the shorter one after
+        stretching, so only that much of each is stretched; the optional pitch
+        shift of track 2 runs in the same stretch pass. Returns equal-length buffers.
+        """
+        track1_factor, track2_factor = self._beat_match_factors(tempo1, tempo2)
+        return self._mix_region(y1, y2, track1_factor, track2_factor, pitch_semitones2)
     
     def beat_match_tracks(self, track1_file: str, track2_file: str) -> Tuple[str, str]:
-        """Automatically match BPMs between two tracks"""
+        """Automatically match BPMs between two tracks; writes both full tracks as WAVs to temp_dir for /beat_match"""
         try:
             logger.info("Beat matching tracks...")
             
             # Analyze both tracks
             analysis1 = self.analyze_audio(track1_file)
             analysis2 = self.analyze_audio(track2_file)
-            
-            # Calculate tempo adjustment factors
-            tempo1, tempo2 = analysis1["tempo"], analysis2["tempo"]
-            
-            # Find the target tempo (average of both tempos for smoother mixing)
-            target_tempo = (tempo1 + tempo2) / 2
-            
-            # Calculate adjustment factors for both tracks
-            track1_factor = target_tempo / tempo1
-            track2_factor = target_tempo / tempo2
-            
-            logger.info(f"Track 1 tempo: {tempo1} -> {target_tempo} (factor: {track1_factor})")
-            logger.info(f"Track 2 tempo: {tempo2} -> {target_tempo} (factor: {track2_factor})")
+            track1_factor, track2_factor = self._beat_match_factors(analysis1["tempo"], analysis2["tempo"])
             
             # Process both tracks to match target tempo
             matched_track1 = self.professional_process(track1_file, tempo_factor=track1_factor)
@@ -134,25 +364,21 @@ class RiddimAudioProcessor:
             logger.error(f"Beat matching failed: {e}")
             raise
     
-    def harmonic_mix_suggestions(self, track1_file: str, track2_file: str) -> Dict:
-        """Analyze harmonic compatibility and suggest optimal mixing parameters"""
+    def harmonic_mix_suggestions(self, track1_file: str, track2_file: str,
+                                 analysis1: Optional[Dict] = None,
+                                 analysis2: Optional[Dict] = None) -> Dict:
+        """Analyze harmonic compatibility and suggest optimal mixing parameters.
+        
+        Precomputed analyses (e.g. from the track_analysis table) skip decoding.
+        """
         try:
             logger.info("Analyzing harmonic compatibility...")
             
-            # Analyze both tracks
-            analysis1 = self.analyze_audio(track1_file)
-            analysis2 = self.analyze_audio(track2_file)
+            # Analyze both tracks unless already known
+            analysis1 = analysis1 or self.analyze_audio(track1_file)
+            analysis2 = analysis2 or self.analyze_audio(track2_file)
             
-            # Calculate key compatibility
-            key1, key2 = analysis1["key"], analysis2["key"]
-            key_diff = abs(key1 - key2)
-            
-            suggestions = {
-                "compatible_keys": key_diff < 0.5,
-                "suggested_pitch_shift": -key_diff if key1 > key2 else key_diff,
-                "tempo_compatibility": abs(analysis1["tempo"] - analysis2["tempo"]) < 5,
-                "energy_balance": analysis1["energy"] / analysis2["energy"] if analysis2["energy"] > 0 else 1.0
-            }
+            suggestions = harmonic_suggestions(analysis1, analysis2)
             
             logger.info(f"Harmonic analysis complete: {suggestions}")
             return suggestions
@@ -162,304 +388,233 @@ class RiddimAudioProcessor:
             raise
     
     def create_professional_mix(self, track1_file: str, track2_file: str, 
-                              mix_params: Optional[Dict] = None) -> str:
-        """Create a professional mix with automatic optimization"""
+                              mix_params: Optional[Dict] = None) -> bytes:
+        """Create a professional mix with automatic optimization; returns WAV bytes"""
         try:
             logger.info("Creating professional mix...")
             
-            # Get harmonic suggestions
-            suggestions = self.harmonic_mix_suggestions(track1_file, track2_file)
+            # Analyze once (decodes are cached) and reuse the tempos for beat matching
+            analysis1 = self.analyze_audio(track1_file)
+            analysis2 = self.analyze_audio(track2_file)
+            suggestions = self.harmonic_mix_suggestions(track1_file, track2_file, analysis1, analysis2)
             
             # Apply suggested optimizations
+            pitch_shift = 0.0
             if not suggestions["compatible_keys"] and mix_params is None:
                 pitch_shift = suggestions["suggested_pitch_shift"]
-                track2_file = self.professional_process(track2_file, pitch_semitones=pitch_shift)
             
-            # Beat match if needed
+            y1, _ = self.load_audio(track1_file)
+            y2, _ = self.load_audio(track2_file)
             if not suggestions["tempo_compatibility"]:
-                track1_file, track2_file = self.beat_match_tracks(track1_file, track2_file)
-            
-            # Load both tracks
-            y1, sr1 = librosa.load(track1_file, sr=self.sr)
-            y2, sr2 = librosa.load(track2_file, sr=self.sr)
-            
-            # Ensure same length
-            min_length = min(len(y1), len(y2))
-            y1 = y1[:min_length]
-            y2 = y2[:min_length]
+                # Beat match in memory, stretching only the mixed region
+                y1, y2 = self.beat_match_buffers(y1, y2, analysis1["tempo"], analysis2["tempo"], pitch_shift)
+            else:
+                # Same length, pitch shifting only the mixed region
+                y1, y2 = self._mix_region(y1, y2, 1.0, 1.0, pitch_shift)
             
             # Apply volume balance if suggested
-            if suggestions["energy_balance"] != 1.0:
-                y2 = y2 * suggestions["energy_balance"]
+            balance = suggestions["energy_balance"]
+            if balance != 1.0:
+                y2 = y2 * balance
             
             # Mix tracks
             mixed = y1 + y2
             
-            # Normalize
-            mixed = mixed / np.max(np.abs(mixed)) * 0.9
+            # Gain toward the target from the analyzed loudness, then limit peaks (no scan of the mix)
+            if self.normalize:
+                levels = [analysis1["loudness_lufs"], analysis2["loudness_lufs"] + 20 * np.log10(max(balance, 1e-6))]
+                mixed *= np.float32(loudness.gain_to_target(loudness.sum_loudness(levels), MIX_TARGET_LUFS, MIX_MAX_GAIN_DB))
+                mixed = self._limited().process_buffer(mixed)
             
-            # Save mixed track
-            output_path = os.path.join(self.temp_dir, "professional_mix.wav")
-            sf.write(output_path, mixed, self.sr)
+            # Encode the mixed track in memory
+            output = encode_audio(mixed, self.sr, "wav")
             
-            logger.info(f"Professional mix created: {output_path}")
-            return output_path
+            logger.info(f"Professional mix created: {len(output)} bytes")
+            return output
             
         except Exception as e:
             logger.error(f"Professional mixing failed: {e}")
             raise
 
-    def create_mix_from_stems(self, track1_stems: list, track2_stems: list, 
-                             mix_params: Optional[Dict] = None) -> str:
-        """Create a professional mix from multiple stems with time windows and advanced parameters"""
+    def plan_mix_from_stems(self, track1_stems: list, track2_stems: list,
+                            mix_params: Optional[Dict] = None,
+                            stem_loudness: Optional[Tuple[list, list]] = None) -> MixPlan:
+        """Decode, stretch and sum each track's stems into a loudness-staged two-track MixPlan.
+        
+        `stem_loudness` is (track1 levels, track2 levels) in LUFS per stem, as
+        stored at ingest (see track_analysis.get_stem_loudness); unknown levels
+        (None) are measured from the decoded stems.
+        """
         try:
             logger.info(f"Creating mix from {len(track1_stems)} track1 stems and {len(track2_stems)} track2 stems")
             
-            # Load and combine all stems for track 1
-            track1_mixed = None
-            for stem_file in track1_stems:
-                y, sr = librosa.load(stem_file, sr=self.sr)
-                
-                # Apply time window if specified
-                if mix_params and "track1_time_window" in mix_params:
-                    time_window = mix_params["track1_time_window"]
-                    start_sample = int(time_window.get("start", 0) * sr)
-                    end_sample = int(time_window.get("end", len(y) / sr) * sr)
-                    y = y[start_sample:end_sample]
-                
-                # Apply tempo and pitch adjustments
-                if mix_params:
-                    if mix_params.get("tempo_factor", 1.0) != 1.0:
-                        y = pyrb.time_stretch(y, sr, mix_params["tempo_factor"])
-                    if mix_params.get("pitch_semitones", 0.0) != 0.0:
-                        y = pyrb.pitch_shift(y, sr, mix_params["pitch_semitones"])
-                
-                # Combine stems
-                if track1_mixed is None:
-                    track1_mixed = y
-                else:
-                    # Ensure same length
-                    min_length = min(len(track1_mixed), len(y))
-                    track1_mixed = track1_mixed[:min_length] + y[:min_length]
-            
-            # Load and combine all stems for track 2
-            track2_mixed = None
-            for stem_file in track2_stems:
-                y, sr = librosa.load(stem_file, sr=self.sr)
-                
-                # Apply time window if specified
-                if mix_params and "track2_time_window" in mix_params:
-                    time_window = mix_params["track2_time_window"]
-                    start_sample = int(time_window.get("start", 0) * sr)
-                    end_sample = int(time_window.get("end", len(y) / sr) * sr)
-                    y = y[start_sample:end_sample]
-                
-                # Apply tempo and pitch adjustments
-                if mix_params:
-                    if mix_params.get("tempo_factor", 1.0) != 1.0:
-                        y = pyrb.time_stretch(y, sr, mix_params["tempo_factor"])
-                    if mix_params.get("pitch_semitones", 0.0) != 0.0:
-                        y = pyrb.pitch_shift(y, sr, mix_params["pitch_semitones"])
-                
-                # Combine stems
-                if track2_mixed is None:
-                    track2_mixed = y
-                else:
-                    # Ensure same length
-                    min_length = min(len(track2_mixed), len(y))
-                    track2_mixed = track2_mixed[:min_length] + y[:min_length]
-            
-            # Ensure both tracks have the same length
-            if track1_mixed is not None and track2_mixed is not None:
-                min_length = min(len(track1_mixed), len(track2_mixed))
-                track1_mixed = track1_mixed[:min_length]
-                track2_mixed = track2_mixed[:min_length]
-                
-                # Mix the two tracks
-                final_mix = track1_mixed + track2_mixed
+            mix_params = mix_params or {}
+            tempo_factor = mix_params.get("tempo_factor", 1.0)
+            pitch_semitones = mix_params.get("pitch_semitones", 0.0)
+            
+            def build_track(stems, track_number):
+                if not stems:
+                    return None
+                time_window = mix_params.get(f"track{track_number}_time_window")
+                gains = mix_params.get(f"track{track_number}_stem_gains")
                 
-                # Normalize to prevent clipping
-                max_val = np.max(np.abs(final_mix))
-                if max_val > 0:
-                    final_mix = final_mix / max_val * 0.9
+                # Optional per-stem overrides: [{"tempo_factor": .., "pitch_semitones": ..}, ...]
+                overrides = mix_params.get(f"track{track_number}_stem_transforms") or [{}] * len(stems)
+                if len(overrides) != len(stems):
+                    raise ValueError(f"Expected {len(stems)} stem transforms for track {track_number}, got {len(overrides)}")
+                transforms = [
+                    (float((o or {}).get("tempo_factor", tempo_factor)),
+                     float((o or {}).get("pitch_semitones", pitch_semitones)))
+                    for o in overrides
+                ]
                 
-                # Save the final mix
-                output_path = os.path.join(self.temp_dir, "your_mix.mp3")
-                sf.write(output_path, final_mix, self.sr)
+                # Same transform for every stem: stretch the cached summed bus once
+                if len(set(transforms)) == 1:
+                    bus = self.load_track_bus(stems, time_window, gains)
+                    return self.stretch_and_shift(bus, *transforms[0])
                 
-                logger.info(f"Mix created successfully: {output_path}")
-                return output_path
-            else:
+                # Stems need different transforms: stretch each one, then sum in one reduction
+                buffers = [
+                    self.stretch_and_shift(self._load_stem(stem_file, time_window), *transform)
+                    for stem_file, transform in zip(stems, transforms)
+                ]
+                return self._sum_stack(self._stack_stems(buffers), gains)
+            
+            track1_mixed = build_track(track1_stems, 1)
+            track2_mixed = build_track(track2_stems, 2)
+            
+            if track1_mixed is None or track2_mixed is None:
                 raise ValueError("No valid stems provided for mixing")
+            
+            # Both tracks start together and the mix ends with the shorter one
+            min_length = min(track1_mixed.shape[-1], track2_mixed.shape[-1])
+            plan = MixPlan([PlacedTrack(track1_mixed), PlacedTrack(track2_mixed)], length=min_length,
+                           effects=EffectsChain.from_params(mix_params.get("effects"), self.sr))
+            
+            # Gain toward the target loudness up front and limit while rendering, so streaming starts at once
+            if self.normalize:
+                track1_levels, track2_levels = stem_loudness or (None, None)
+                mix_loudness = loudness.sum_loudness([
+                    self._track_loudness(track1_stems, track1_levels, mix_params.get("track1_time_window"),
+                                         mix_params.get("track1_stem_gains")),
+                    self._track_loudness(track2_stems, track2_levels, mix_params.get("track2_time_window"),
+                                         mix_params.get("track2_stem_gains")),
+                ])
+                plan.gain = loudness.gain_to_target(mix_loudness, MIX_TARGET_LUFS, MIX_MAX_GAIN_DB)
+                plan.effects = self._limited(plan.effects)
+            return plan
                 
         except Exception as e:
             logger.error(f"Stem mixing failed: {e}")
             raise
     
-    def create_mix_with_offset_and_crossfade(self, track1_urls, track2_urls, track1_delay=0, track2_delay=0, crossfade_duration=3, crossfade_style='linear'):
-        # Import requests for URL downloading
-        import requests
-        import tempfile
+    def create_mix_from_stems(self, track1_stems: list, track2_stems: list, 
+                             mix_params: Optional[Dict] = None,
+                             stem_loudness: Optional[Tuple[list, list]] = None) -> bytes:
+        """Create a professional mix from multiple stems with time windows and advanced parameters; returns MP3 bytes"""
+        plan = self.plan_mix_from_stems(track1_stems, track2_stems, mix_params, stem_loudness)
+        output = encode_audio(plan.render(), self.sr, "mp3", bitrate=self.mp3_bitrate)
+        logger.info(f"Mix created successfully: {len(output)} bytes")
+        return output
+    
+    def stream_mix(self, plan: MixPlan, block_size: int = RENDER_BLOCK_SIZE) -> Iterator[bytes]:
+        """Render a plan block by block and yield MP3 bytes as they are encoded"""
+        return encode_mp3_stream(plan.blocks(block_size), self.sr, plan.channels, self.mp3_bitrate)
+    
+    def plan_mix_with_offset_and_crossfade(self, track1_urls, track2_urls, track1_delay=0, track2_delay=0, crossfade_duration=3, crossfade_style='linear',
+                                           stem_loudness: Optional[Tuple[list, list]] = None) -> MixPlan:
+        """Place two stem sets at their delays and crossfade them inside their overlap.
+        
+        Stems are decoded to float32 (stereo kept) and summed per track; the crossfade
+        is a vectorized gain curve ('linear', 'equal-power', 's-curve',
+        'ease-in'/'log', 'ease-out'/'exp') applied while the plan is rendered.
+        Each track is gained to the target loudness (from `stem_loudness`, as in
+        plan_mix_from_stems) so the transition is level-matched, then limited.
+        """
+        # 1. Load all stems for each track and mix down (remote stems fetched concurrently through the cache)
+        remote_urls = [url for url in track1_urls + track2_urls if url.startswith('http')]
+        logger.info(f"Fetching {len(remote_urls)} stems from URLs")
+        cached = dict(zip(remote_urls, stem_cache.fetch_all(remote_urls)))
         
-        # 1. Load all stems for each track and mix down to stereo
         def mix_stems(stem_urls):
-            stems = []
-            temp_files = []
-            
-            try:
-                for url in stem_urls:
-                    if url.startswith('http'):
-                        # Download URL to temporary file
-                        logger.info(f"Downloading stem from URL: {url}")
-                        response = requests.get(url, stream=True)
-                        response.raise_for_status()
-                        
-                        # Create temporary file
-                        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-                        for chunk in response.iter_content(chunk_size=8192):
-                            temp_file.write(chunk)
-                        temp_file.close()
-                        temp_files.append(temp_file.name)
-                        
-                        # Load from temporary file
-                        stem = AudioSegment.from_file(temp_file.name)
-                        stems.append(stem)
-                    else:
-                        # Assume it's a local file path
-                        stem = AudioSegment.from_file(url)
-                        stems.append(stem)
-                
-                if not stems:
-                    return None
-                    
-                # Mix all stems together
-                mix = stems[0]
-                for s in stems[1:]:
-                    mix = mix.overlay(s)
-                return mix
-                
-            finally:
-                # Clean up temporary files
-                for temp_file in temp_files:
-                    try:
-                        os.remove(temp_file)
-                    except:
-                        pass
-
+            if not stem_urls:
+                return None
+            return self.load_track_bus([cached.get(url, url) for url in stem_urls], mono=False)
+        
         track1 = mix_stems(track1_urls)
         track2 = mix_stems(track2_urls)
         if track1 is None or track2 is None:
             raise Exception('Could not load stems for one or both tracks')
-
-        logger.info(f"Original track lengths: track1={len(track1)}ms, track2={len(track2)}ms")
+        
+        logger.info(f"Original track lengths: track1={track1.shape[-1] / self.sr:.2f}s, track2={track2.shape[-1] / self.sr:.2f}s")
         logger.info(f"Delays: track1={track1_delay}s, track2={track2_delay}s")
         logger.info(f"Crossfade: {crossfade_duration}s, style={crossfade_style}")
-
-        # 2. Calculate total length with delays
-        track1_delay_ms = int(track1_delay * 1000)
-        track2_delay_ms = int(track2_delay * 1000)
-        crossfade_ms = int(crossfade_duration * 1000)
-        
-        # Total length of each track when positioned with delay
-        track1_end_time = track1_delay_ms + len(track1)
-        track2_end_time = track2_delay_ms + len(track2)
-        
-        # Final mix length is the latest end time
-        final_length = max(track1_end_time, track2_end_time)
         
-        # 3. Create positioned tracks with proper delays
-        logger.info(f"Creating mix with final length: {final_length}ms")
-        logger.info(f"Track1 will start at: {track1_delay_ms}ms ({track1_delay}s)")
-        logger.info(f"Track2 will start at: {track2_delay_ms}ms ({track2_delay}s)")
+        # 2. Position tracks by their delays, with crossfade gain curves in the overlap
+        tracks, length, region = place_with_crossfade(
+            track1, track2, self.sr,
+            track1_delay=track1_delay, track2_delay=track2_delay,
+            crossfade_duration=crossfade_duration, crossfade_style=crossfade_style,
+        )
+        if region:
+            logger.info(f"Crossfade region: {region[0] / self.sr:.2f}s to {region[1] / self.sr:.2f}s")
         
-        # Start with silence for the full length
-        positioned_track1 = AudioSegment.silent(duration=final_length)
-        positioned_track2 = AudioSegment.silent(duration=final_length)
+        logger.info(f"Creating mix with final length: {length / self.sr:.2f}s")
+        plan = MixPlan(tracks, length=length)
         
-        # Overlay tracks at their delayed positions
-        positioned_track1 = positioned_track1.overlay(track1, position=track1_delay_ms)
-        positioned_track2 = positioned_track2.overlay(track2, position=track2_delay_ms)
-        
-        logger.info(f"Track1 positioned: starts at {track1_delay_ms}ms, ends at {track1_delay_ms + len(track1)}ms")
-        logger.info(f"Track2 positioned: starts at {track2_delay_ms}ms, ends at {track2_delay_ms + len(track2)}ms")
+        # 3. Level-match the tracks from their loudness and limit while rendering
+        if self.normalize:
+            for track, stem_urls, levels in zip(tracks, (track1_urls, track2_urls), stem_loudness or (None, None)):
+                stems = [cached.get(url, url) for url in stem_urls]
+                track_loudness = self._track_loudness(stems, levels, mono=False)
+                track.gain = loudness.gain_to_target(track_loudness, MIX_TARGET_LUFS, MIX_MAX_GAIN_DB)
+            plan.effects = self._limited()
+        return plan
+    
+    def create_mix_with_offset_and_crossfade(self, track1_urls, track2_urls, track1_delay=0, track2_delay=0, crossfade_duration=3, crossfade_style='linear',
+                                             stem_loudness: Optional[Tuple[list, list]] = None):
+        """Render plan_mix_with_offset_and_crossfade into a single buffer; returns MP3 bytes"""
+        plan = self.plan_mix_with_offset_and_crossfade(
+            track1_urls, track2_urls, track1_delay, track2_delay, crossfade_duration, crossfade_style,
+            stem_loudness,
+        )
+        output = encode_audio(plan.render(), self.sr, "mp3", bitrate=self.mp3_bitrate)
+        logger.info(f"Mix exported: {len(output)} bytes")
+        return output
+    
+    def plan_mix_graph(self, spec: Dict, sources: Optional[Dict] = None,
+                       stem_loudness: Optional[list] = None) -> GraphPlan:
+        """Build a lazily rendered N-track mix from a mix graph request (see mix_graph.py).
         
-        # 4. Apply crossfade if tracks overlap
-        overlap_start = max(track1_delay_ms, track2_delay_ms)
-        overlap_end = min(track1_end_time, track2_end_time)
+        `sources` maps stem URLs to local paths already fetched through the
+        stem cache. Track lists are level-matched per track from
+        `stem_loudness` (one list of stem levels per track, as in
+        plan_mix_with_offset_and_crossfade); node graphs keep the gains they
+        specify. Both are limited while rendering.
+        """
+        graph = MixGraph(self, sources)
+        tracks = spec.get("tracks")
+        track_gains = None
+        if self.normalize and tracks:
+            track_gains = []
+            for track, levels in zip(tracks, stem_loudness or [None] * len(tracks)):
+                stems = [graph.sources.get(url, url) for url in track["urls"]]
+                track_loudness = self._track_loudness(stems, levels, track_time_window(track),
+                                                      track.get("stem_gains"), mono=False)
+                track_gains.append(loudness.gain_to_target(track_loudness, MIX_TARGET_LUFS, MIX_MAX_GAIN_DB))
         
-        if crossfade_ms > 0 and overlap_end > overlap_start:
-            # Calculate crossfade region within the overlap
-            overlap_duration = overlap_end - overlap_start
-            actual_crossfade_ms = min(crossfade_ms, overlap_duration)
-            
-            if actual_crossfade_ms > 0:
-                # Create crossfade in the middle of overlap region
-                crossfade_start = overlap_start + (overlap_duration - actual_crossfade_ms) // 2
-                crossfade_end = crossfade_start + actual_crossfade_ms
-                
-                logger.info(f"Crossfade region: {crossfade_start}ms to {crossfade_end}ms")
-                
-                # Apply crossfade style
-                if crossfade_style == 'ease-in':
-                    # Track1 fades out with ease-in curve, track2 comes in linearly
-                    fade_curve = 'logarithmic'
-                elif crossfade_style == 'ease-out': 
-                    # Track1 fades out linearly, track2 comes in with ease-out curve
-                    fade_curve = 'exponential'
-                elif crossfade_style == 's-curve':
-                    # Both tracks use smooth S-curve
-                    fade_curve = 'logarithmic'
-                else:  # linear
-                    fade_curve = 'linear'
-                
-                # Extract crossfade segments
-                track1_segment = positioned_track1[crossfade_start:crossfade_end]
-                track2_segment = positioned_track2[crossfade_start:crossfade_end]
-                
-                # Apply fades to segments
-                track1_faded = track1_segment.fade_out(actual_crossfade_ms)
-                track2_faded = track2_segment.fade_in(actual_crossfade_ms)
-                
-                # Create crossfaded segment
-                crossfaded_segment = track1_faded.overlay(track2_faded)
-                
-                # Rebuild final mix with crossfaded section
-                mix = AudioSegment.silent(duration=final_length)
-                
-                # Add track1 before crossfade
-                if crossfade_start > 0:
-                    mix = mix.overlay(positioned_track1[:crossfade_start], position=0)
-                
-                # Add crossfaded section
-                mix = mix.overlay(crossfaded_segment, position=crossfade_start)
-                
-                # Add track1 after crossfade (if any)
-                if crossfade_end < len(positioned_track1):
-                    mix = mix.overlay(positioned_track1[crossfade_end:], position=crossfade_end)
-                
-                # Add track2 before crossfade (if any)  
-                if crossfade_start > track2_delay_ms:
-                    track2_before = positioned_track2[track2_delay_ms:crossfade_start]
-                    mix = mix.overlay(track2_before, position=track2_delay_ms)
-                
-                # Add track2 after crossfade
-                if crossfade_end < len(positioned_track2):
-                    mix = mix.overlay(positioned_track2[crossfade_end:], position=crossfade_end)
-            else:
-                # No crossfade, just overlay
-                mix = positioned_track1.overlay(positioned_track2)
-        else:
-            # No overlap or crossfade, just overlay
-            mix = positioned_track1.overlay(positioned_track2)
-
-        # 5. Export final mix with unique filename to prevent caching
-        import time
-        timestamp = int(time.time() * 1000)  # millisecond timestamp
-        output_filename = f'your_mix_{timestamp}.mp3'
-        output_path = os.path.join(self.temp_dir, output_filename)
-        mix.export(output_path, format='mp3')
-        logger.info(f"Mix exported to: {output_path}")
-        return output_path
+        root = graph.build(spec, track_gains)
+        plan = GraphPlan(root, effects=EffectsChain.from_params(spec.get("effects"), self.sr))
+        if self.normalize:
+            plan.effects = self._limited(plan.effects)
+        logger.info(f"Mix graph: {len(graph)} nodes, {root.channels} channels, {root.length / self.sr:.2f}s")
+        return plan
+    
+    def render_plan(self, plan: MixPlan) -> bytes:
+        """Render a plan into a single buffer; returns MP3 bytes"""
+        output = encode_audio(plan.render(), self.sr, "mp3", bitrate=self.mp3_bitrate)
+        logger.info(f"Mix exported: {len(output)} bytes")
+        return output
     
     def cleanup_temp_files(self, max_age_hours=24):
         """Clean up temporary audio files older than max_age_hours"""
@@ -1,5 +1,7 @@
 import os
-import requests
+import time
+import asyncio
+import httpx
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -7,42 +9,155 @@ load_dotenv()
 SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
 SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 
-# Get Spotify access token
-def get_spotify_token():
-    auth_url = "https://accounts.spotify.com/api/token"
-    auth_response = requests.post(auth_url, {
-        'grant_type': 'client_credentials',
-        'client_id': SPOTIFY_CLIENT_ID,
-        'client_secret': SPOTIFY_CLIENT_SECRET,
-    })
-    auth_response.raise_for_status()
-    return auth_response.json()['access_token']
-
-# Search Spotify tracks
-def spotify_search(query, page=1, genre=None, sort=None):
-    token = get_spotify_token()
-    headers = {"Authorization": f"Bearer {token}"}
-    params = {
-        "q": query,
-        "type": "track",
-        "limit": 20,
-        "offset": (page-1)*20
-    }
-    if genre:
-        params["q"] += f" genre:{genre}"
-    url = "https://api.spotify.com/v1/search"
-    r = requests.get(url, headers=headers, params=params)
-    r.raise_for_status()
-    data = r.json()
-    results = []
-    for item in data.get("tracks", {}).get("items", []):
-        results.append({
-            "id": item["id"],
-            "title": item["name"],
-            "artist": ", ".join([a["name"] for a in item["artists"]]),
-            "album": item["album"]["name"],
-            "artwork": item["album"]["images"][0]["url"] if item["album"]["images"] else None,
-            "duration": item["duration_ms"] // 1000,
-            "preview_url": item["preview_url"]
+# Base URLs are overridable so tests can point at spotify_stub.py
+SPOTIFY_ACCOUNTS_URL = os.getenv("SPOTIFY_ACCOUNTS_URL", "https://accounts.spotify.com")
+SPOTIFY_API_URL = os.getenv("SPOTIFY_API_URL", "https://api.spotify.com")
+
+# Shared connection pool sizing; with HTTP/2 many searches multiplex over few connections
+SPOTIFY_MAX_CONNECTIONS = int(os.getenv("SPOTIFY_MAX_CONNECTIONS", "100"))
+SPOTIFY_MAX_KEEPALIVE = int(os.getenv("SPOTIFY_MAX_KEEPALIVE", "20"))
+SPOTIFY_TIMEOUT = float(os.getenv("SPOTIFY_TIMEOUT", "10"))  # connect/read/write seconds
+SPOTIFY_POOL_TIMEOUT = float(os.getenv("SPOTIFY_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+
+# Refresh the token this many seconds before Spotify says it expires
+TOKEN_EXPIRY_MARGIN = 60
+# Within this window before the margin, serve the cached token and refresh in the background
+TOKEN_BACKGROUND_REFRESH_WINDOW = 300
+
+try:
+    import h2  # noqa: F401  (enables httpx's HTTP/2 support)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+class SpotifyTokenManager:
+    """Caches the client-credentials token until shortly before it expires.
+
+    Only one refresh runs at a time: callers that find the token expired wait on
+    the lock and reuse whatever the first caller fetched. When the token is still
+    valid but close to expiry, it is refreshed in a background task while the
+    current token keeps being served.
+    """
+
+    def __init__(self, fetch_token):
+        self._fetch_token = fetch_token
+        self._lock = None  # created on first use so it binds to the running loop
+        self._token = None
+        self._expires_at = 0.0
+        self._refresh_task = None
+
+    async def _refresh(self):
+        token, expires_in = await self._fetch_token()
+        self._token = token
+        self._expires_at = time.monotonic() + expires_in - TOKEN_EXPIRY_MARGIN
+
+    async def _background_refresh(self):
+        try:
+            async with self._lock:
+                await self._refresh()
+        except Exception as e:
+            print(f"[SpotifyToken] Background refresh failed: {e}")
+        finally:
+            self._refresh_task = None
+
+    async def get_token(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        now = time.monotonic()
+        if self._token and now < self._expires_at:
+            if now > self._expires_at - TOKEN_BACKGROUND_REFRESH_WINDOW and self._refresh_task is None:
+                self._refresh_task = asyncio.create_task(self._background_refresh())
+            return self._token
+        async with self._lock:
+            # Another caller may have refreshed while we waited for the lock
+            if not self._token or time.monotonic() >= self._expires_at:
+                await self._refresh()
+            return self._token
+
+    def invalidate(self):
+        self._expires_at = 0.0
+
+class SpotifyClient:
+    """Async Spotify Web API client on one shared keep-alive connection pool.
+
+    The underlying httpx.AsyncClient is created lazily inside the running event
+    loop and reused by every search and token refresh, so TLS handshakes happen
+    once per pooled connection rather than once per request. HTTP/2 is used when
+    the `h2` package is installed.
+    """
+
+    def __init__(self, client_id=None, client_secret=None,
+                 accounts_url=SPOTIFY_ACCOUNTS_URL, api_url=SPOTIFY_API_URL):
+        self.client_id = client_id or SPOTIFY_CLIENT_ID
+        self.client_secret = client_secret or SPOTIFY_CLIENT_SECRET
+        self.accounts_url = accounts_url.rstrip("/")
+        self.api_url = api_url.rstrip("/")
+        self.tokens = SpotifyTokenManager(self.fetch_token)
+        self._client = None
+
+    def _get_client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=SPOTIFY_MAX_CONNECTIONS,
+                    max_keepalive_connections=SPOTIFY_MAX_KEEPALIVE,
+                ),
+                timeout=httpx.Timeout(SPOTIFY_TIMEOUT, pool=SPOTIFY_POOL_TIMEOUT),
+            )
+        return self._client
+
+    # Get Spotify access token
+    async def fetch_token(self):
+        auth_response = await self._get_client().post(f"{self.accounts_url}/api/token", data={
+            'grant_type': 'client_credentials',
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
         })
-    return {"results": results, "page": page, "total": data.get("tracks", {}).get("total", 0)} 
\ No newline at end of file
+        auth_response.raise_for_status()
+        data = auth_response.json()
+        return data['access_token'], data.get('expires_in', 3600)
+
+    # Search Spotify tracks
+    async def search(self, query, page=1, genre=None, sort=None):
+        params = {
+            "q": query,
+            "type": "track",
+            "limit": 20,
+            "offset": (page-1)*20
+        }
+        if genre:
+            params["q"] += f" genre:{genre}"
+        url = f"{self.api_url}/v1/search"
+        client = self._get_client()
+        token = await self.tokens.get_token()
+        r = await client.get(url, headers={"Authorization": f"Bearer {token}"}, params=params)
+        if r.status_code == 401:
+            # Token revoked or expired early: fetch a fresh one and retry once
+            self.tokens.invalidate()
+            token = await self.tokens.get_token()
+            r = await client.get(url, headers={"Authorization": f"Bearer {token}"}, params=params)
+        r.raise_for_status()
+        data = r.json()
+        results = []
+        for item in data.get("tracks", {}).get("items", []):
+            results.append({
+                "id": item["id"],
+                "title": item["name"],
+                "artist": ", ".join([a["name"] for a in item["artists"]]),
+                "album": item["album"]["name"],
+                "artwork": item["album"]["images"][0]["url"] if item["album"]["images"] else None,
+                "duration": item["duration_ms"] // 1000,
+                "preview_url": item["preview_url"]
+            })
+        return {"results": results, "page": page, "total": data.get("tracks", {}).get("total", 0)}
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+spotify_client = SpotifyClient()
+
+async def spotify_search(query, page=1, genre=None, sort=None):
+    return await spotify_client.search(query, page, genre, sort)
@@ -1,10 +1,70 @@
+import os
 from celery import Celery
+from kombu import Queue
+
+# memory:// (with CELERY_TASK_ALWAYS_EAGER=1) runs jobs in-process for local testing
+CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://localhost:6379/0")
+CELERY_RESULT_BACKEND = os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0")
+CELERY_TASK_ALWAYS_EAGER = os.getenv("CELERY_TASK_ALWAYS_EAGER", "0") == "1"
+# Longest a submitted render may wait in its queue and still be joined by resubmissions
+RENDER_JOB_CLAIM_TTL = int(os.getenv("RENDER_JOB_CLAIM_TTL", "3600"))
+
+# Render queues in the order workers drain them: previews always ahead of final exports
+RENDER_QUEUES = {
+    "preview": "render_preview",
+    "final": "render_final",
+}
 
 celery_app = Celery(
     "worker",
-    broker="redis://localhost:6379/0",
-    backend="redis://localhost:6379/0"
+    broker=CELERY_BROKER_URL,
+    backend=CELERY_RESULT_BACKEND,
+    include=["tasks"],
 )
 celery_app.conf.task_routes = {
     "tasks.*": {"queue": "default"},
-} 
\ No newline at end of file
+}
+celery_app.conf.update(
+    task_queues=[Queue(name) for name in RENDER_QUEUES.values()] + [Queue("default")],
+    task_default_queue="default",
+    # Redis: poll queues in declaration order instead of round robin
+    broker_transport_options={"queue_order_strategy": "priority"},
+    # One render at a time per worker process, acked when done so a crash requeues it
+    worker_prefetch_multiplier=1,
+    task_acks_late=True,
+    task_track_started=True,
+    result_expires=int(os.getenv("RENDER_RESULT_EXPIRES", "3600")),
+    task_always_eager=CELERY_TASK_ALWAYS_EAGER,
+    task_store_eager_result=True,
+)
+
+
+def queue_depth(queue_name):
+    """Messages waiting in a broker queue; raises if the broker can't be reached"""
+    with celery_app.connection_for_read() as conn:
+        conn.ensure_connection(max_retries=1)
+        # Declaring (idempotent) rather than a passive check: Redis has no key for an empty queue
+        return Queue(queue_name).bind(conn.default_channel).queue_declare().message_count
+
+
+def _claim_key(job_id):
+    return f"render_job_claim:{job_id}"
+
+
+def claim_render_job(job_id):
+    """Atomically mark a render job id as submitted; False if it already is (queued or running).
+
+    Queued and unknown jobs both report PENDING, so the claim is what tells
+    them apart. Without a Redis result backend every claim succeeds.
+    """
+    client = getattr(celery_app.backend, "client", None)
+    if client is None:
+        return True
+    return bool(client.set(_claim_key(job_id), 1, nx=True, ex=RENDER_JOB_CLAIM_TTL))
+
+
+def release_render_job(job_id):
+    """Drop a job's claim once it has finished (its result state takes over) or could not be queued"""
+    client = getattr(celery_app.backend, "client", None)
+    if client is not None:
+        client.delete(_claim_key(job_id))
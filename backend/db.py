@@ -1,5 +1,9 @@
 import os
+import time
+import threading
+from contextlib import contextmanager
 import psycopg2
+from psycopg2 import pool
 from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
@@ -7,16 +11,286 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Pool sizing and timeouts (override via environment)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_CHECKOUT_TIMEOUT = float(os.getenv("DB_POOL_CHECKOUT_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_HEALTHCHECK_IDLE = float(os.getenv("DB_POOL_HEALTHCHECK_IDLE", "30"))  # ping connections idle longer than this
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within the checkout timeout"""
+
+
+class StemsConnectionPool:
+    """Thread-safe psycopg2 pool shared by all API endpoints.
+
+    Connections are opened lazily, reused across requests and checked for
+    health on checkout. Every connection runs in autocommit mode with a
+    server-side statement_timeout so a slow query can't pin a slot.
+    """
+
+    def __init__(self, dsn, min_size=1, max_size=10, checkout_timeout=10.0,
+                 healthcheck_idle=30.0, statement_timeout_ms=5000):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.healthcheck_idle = healthcheck_idle
+        self.statement_timeout_ms = statement_timeout_ms
+        self._pool = None
+        self._init_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        # psycopg2's ThreadedConnectionPool raises when exhausted; the semaphore
+        # makes callers wait (up to checkout_timeout) for a slot instead
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._last_used = {}
+        self._in_use = 0
+        self._waiting = 0
+        self._checkouts = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+        self._timeouts = 0
+        self._healthcheck_failures = 0
+
+    def _get_pool(self):
+        if self._pool is None:
+            with self._init_lock:
+                if self._pool is None:
+                    self._pool = pool.ThreadedConnectionPool(
+                        self.min_size,
+                        self.max_size,
+                        self.dsn,
+                        cursor_factory=RealDictCursor,
+                        options=f"-c statement_timeout={self.statement_timeout_ms}",
+                    )
+        return self._pool
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.healthcheck_idle:
+            return True
+        # Idle for a while (or brand new): the proxy may have dropped it
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self, db_pool):
+        """A pooled connection in autocommit mode that passed its health check, or None (it was discarded)"""
+        conn = db_pool.getconn()
+        try:
+            # Before the ping, so the ping can't leave a transaction open
+            if not conn.closed:
+                conn.autocommit = True
+                if self._is_healthy(conn):
+                    return conn
+        except psycopg2.Error:
+            pass
+        with self._stats_lock:
+            self._healthcheck_failures += 1
+        self._last_used.pop(id(conn), None)
+        db_pool.putconn(conn, close=True)
+        return None
+
+    def getconn(self):
+        started = time.monotonic()
+        with self._stats_lock:
+            self._waiting += 1
+        acquired = self._slots.acquire(timeout=self.checkout_timeout)
+        with self._stats_lock:
+            self._waiting -= 1
+            if not acquired:
+                self._timeouts += 1
+        if not acquired:
+            raise PoolTimeout(f"No database connection available after {self.checkout_timeout}s")
+        try:
+            db_pool = self._get_pool()
+            # A dropped connection is replaced once; the replacement is checked too
+            conn = self._checkout(db_pool) or self._checkout(db_pool)
+            if conn is None:
+                raise psycopg2.OperationalError("No healthy database connection available")
+        except Exception:
+            self._slots.release()
+            raise
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._checkout_time_total += elapsed
+            self._checkout_time_max = max(self._checkout_time_max, elapsed)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            close = close or conn.closed
+            if close:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._get_pool().putconn(conn, close=close)
+        finally:
+            with self._stats_lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, close=broken)
+
+    def stats(self):
+        with self._stats_lock:
+            avg_ms = (self._checkout_time_total / self._checkouts * 1000) if self._checkouts else 0.0
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "checkout_latency_avg_ms": round(avg_ms, 3),
+                "checkout_latency_max_ms": round(self._checkout_time_max * 1000, 3),
+                "timeouts": self._timeouts,
+                "healthcheck_failures": self._healthcheck_failures,
+            }
+
+    def close(self):
+        with self._init_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+                self._last_used.clear()
+
+
+db_pool = StemsConnectionPool(
+    DATABASE_URL,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    checkout_timeout=DB_POOL_CHECKOUT_TIMEOUT,
+    healthcheck_idle=DB_POOL_HEALTHCHECK_IDLE,
+    statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS,
+)
+
 def get_db_connection():
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
-    return conn
+    """Check out a pooled connection: `with get_db_connection() as conn: ...`"""
+    return db_pool.connection()
+
+def get_pool_stats():
+    return db_pool.stats()
+
+def close_db_pool():
+    db_pool.close()
 
 def get_stems_by_spotify_id(spotify_track_id):
-    conn = get_db_connection()
-    try:
+    with get_db_connection() as conn:
         with conn.cursor() as cur:
             cur.execute("SELECT * FROM stems WHERE spotify_track_id = %s", (spotify_track_id,))
             row = cur.fetchone()
         return row
-    finally:
-        conn.close() 
\ No newline at end of file
+
+def get_stems_by_spotify_ids(spotify_track_ids):
+    """Fetch stems rows for many tracks in one round trip, keyed by spotify_track_id"""
+    ids = list(dict.fromkeys(spotify_track_ids))
+    if not ids:
+        return {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT * FROM stems WHERE spotify_track_id = ANY(%s)", (ids,))
+            rows = cur.fetchall()
+    return {row["spotify_track_id"]: row for row in rows}
+
+STEM_COLUMNS = ("vocals_url", "drums_url", "bass_url", "other_url")
+
+def get_catalog_stem_urls(limit=None):
+    """Every stem URL in the stems table, highest-ranked tracks first"""
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"SELECT {', '.join(STEM_COLUMNS)} FROM stems ORDER BY rank NULLS LAST LIMIT %s",
+                (limit,),
+            )
+            rows = cur.fetchall()
+    return [row[column] for row in rows for column in STEM_COLUMNS if row.get(column)]
+
+TRACK_ANALYSIS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS track_analysis (
+    spotify_track_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    tempo REAL,
+    tuning REAL,
+    rms_energy REAL,
+    duration REAL,
+    beat_times REAL[],
+    loudness_lufs REAL,
+    true_peak_dbtp REAL,
+    analyzed_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (spotify_track_id, source)
+);
+ALTER TABLE track_analysis ADD COLUMN IF NOT EXISTS loudness_lufs REAL;
+ALTER TABLE track_analysis ADD COLUMN IF NOT EXISTS true_peak_dbtp REAL;
+"""
+
+def ensure_track_analysis_table():
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(TRACK_ANALYSIS_SCHEMA)
+
+def get_track_analyses(keys):
+    """Fetch precomputed analyses for (spotify_track_id, source) pairs in one query.
+
+    `source` is "full_song" or a stem name ("vocals", "drums", "bass", "other").
+    Returns a dict keyed by (spotify_track_id, source); missing pairs are absent.
+    """
+    keys = list(dict.fromkeys(keys))
+    if not keys:
+        return {}
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT * FROM track_analysis WHERE (spotify_track_id, source) IN %s",
+                (tuple(keys),),
+            )
+            rows = cur.fetchall()
+    return {(row["spotify_track_id"], row["source"]): row for row in rows}
+
+def save_track_analysis(spotify_track_id, source, analysis):
+    with get_db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO track_analysis (
+                    spotify_track_id, source, tempo, tuning, rms_energy, duration, beat_times,
+                    loudness_lufs, true_peak_dbtp
+                ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (spotify_track_id, source) DO UPDATE SET
+                    tempo = EXCLUDED.tempo,
+                    tuning = EXCLUDED.tuning,
+                    rms_energy = EXCLUDED.rms_energy,
+                    duration = EXCLUDED.duration,
+                    beat_times = EXCLUDED.beat_times,
+                    loudness_lufs = EXCLUDED.loudness_lufs,
+                    -- Request-time analyses don't measure true peak; keep the ingest value
+                    true_peak_dbtp = COALESCE(EXCLUDED.true_peak_dbtp, track_analysis.true_peak_dbtp),
+                    analyzed_at = NOW()
+            """, (
+                spotify_track_id,
+                source,
+                analysis["tempo"],
+                analysis["key"],
+                analysis["energy"],
+                analysis["duration"],
+                analysis["beat_times"],
+                analysis.get("loudness_lufs"),
+                analysis.get("true_peak_dbtp"),
+            ))
@@ -0,0 +1,129 @@
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared across all requests so concurrent mixes can't open unbounded sockets
+DOWNLOAD_MAX_WORKERS = int(os.getenv("DOWNLOAD_MAX_WORKERS", "16"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))  # 1 MB reads
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "5"))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "30"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_BACKOFF = 0.5  # seconds, doubled after each failed attempt
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class DownloadError(Exception):
+    """A concurrent batch failed; carries the first error and the results that succeeded"""
+
+    def __init__(self, cause, partial_results):
+        super().__init__(str(cause))
+        self.cause = cause
+        self.partial_results = partial_results
+
+
+class StemDownloader:
+    """Bounded, pooled downloader for stem files on storage.googleapis.com.
+
+    A fixed thread pool, each worker holding its own keep-alive session, is
+    shared by all requests, so a mix fetches all of its stems in parallel and
+    waits only as long as the slowest one. Each URL gets its own timeout and
+    is retried with exponential backoff on connection errors and 5xx/429.
+    """
+
+    def __init__(self, max_workers=DOWNLOAD_MAX_WORKERS, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                 connect_timeout=DOWNLOAD_CONNECT_TIMEOUT, read_timeout=DOWNLOAD_READ_TIMEOUT,
+                 retries=DOWNLOAD_RETRIES):
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stem-dl")
+        self._local = threading.local()
+
+    def _session(self):
+        # requests.Session isn't documented as thread-safe; give each worker its own pool
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._local.session = session
+        return session
+
+    def fetch_to_file(self, url, path, etag=None):
+        """Stream `url` into `path`, retrying transient failures.
+
+        Returns the response headers, or None when `etag` still matches
+        (304 Not Modified) and nothing was written.
+        """
+        headers = {"If-None-Match": etag} if etag else None
+        delay = DOWNLOAD_BACKOFF
+        for attempt in range(self.retries + 1):
+            try:
+                with self._session().get(url, stream=True, timeout=self.timeout, headers=headers) as r:
+                    if r.status_code == 304:
+                        return None
+                    if r.status_code in RETRYABLE_STATUS and attempt < self.retries:
+                        raise requests.HTTPError(f"{r.status_code} from {url}", response=r)
+                    r.raise_for_status()
+                    with open(path, "wb") as f:
+                        for chunk in r.iter_content(chunk_size=self.chunk_size):
+                            f.write(chunk)
+                    return r.headers
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                status = getattr(getattr(e, "response", None), "status_code", None)
+                if attempt >= self.retries or (status is not None and status not in RETRYABLE_STATUS):
+                    raise
+                print(f"[Downloader] Retry {attempt + 1}/{self.retries} for {url}: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+    def download(self, url, suffix=".mp3"):
+        """Download one URL to a new temp file and return its path"""
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            self.fetch_to_file(url, path)
+            return path
+        except Exception:
+            os.remove(path)
+            raise
+
+    def map(self, fn, items):
+        """Run fn over items on the shared pool; results keep input order.
+
+        Every item is waited for before the first error is re-raised.
+        """
+        futures = [self._executor.submit(fn, item) for item in items]
+        results, error = [], None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise DownloadError(error, results)
+        return results
+
+    def download_all(self, urls, suffix=".mp3"):
+        """Download all URLs concurrently; returns temp paths in the same order.
+
+        If any download fails, the files that did succeed are removed before
+        the error is raised, so callers only clean up on success.
+        """
+        try:
+            return self.map(lambda url: self.download(url, suffix), urls)
+        except DownloadError as e:
+            for path in e.partial_results:
+                if os.path.exists(path):
+                    os.remove(path)
+            raise e.cause
+
+
+stem_downloader = StemDownloader()
@@ -0,0 +1,27 @@
+"""Harmonic mixing suggestions from track analyses.
+
+Pure functions of analysis dicts (stored in track_analysis or measured by
+RiddimAudioProcessor.analyze_audio), so no audio, database or DSP stack is needed.
+"""
+
+
+def harmonic_suggestions(analysis1, analysis2):
+    """Mixing suggestions from two track analyses (no audio needed)"""
+    # Calculate key compatibility
+    key1, key2 = analysis1["key"], analysis2["key"]
+    key_diff = abs(key1 - key2)
+
+    return {
+        "compatible_keys": key_diff < 0.5,
+        "suggested_pitch_shift": -key_diff if key1 > key2 else key_diff,
+        "tempo_compatibility": abs(analysis1["tempo"] - analysis2["tempo"]) < 5,
+        "energy_balance": _energy_balance(analysis1, analysis2),
+    }
+
+
+def _energy_balance(analysis1, analysis2):
+    """Gain bringing track 2 to track 1's level: from integrated loudness when both have it, else RMS energy"""
+    loudness1, loudness2 = analysis1.get("loudness_lufs"), analysis2.get("loudness_lufs")
+    if loudness1 is not None and loudness2 is not None:
+        return 10 ** ((loudness1 - loudness2) / 20)
+    return analysis1["energy"] / analysis2["energy"] if analysis2["energy"] > 0 else 1.0
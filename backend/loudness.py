@@ -0,0 +1,141 @@
+"""ITU-R BS.1770 loudness: integrated and short-term LUFS, and true peak.
+
+Measured once per stem at ingest (musicdatabase/riddim_batch_processor.py
+imports this module, so both sides measure identically) and stored in
+track_analysis and the analysis sidecar, so the mixer can set gains before
+rendering instead of scanning the rendered mix for its peak.
+
+Buffers are librosa-style: (n,) mono or (channels, n). Mono buffers are
+measured as dual mono (one signal on two speakers), which keeps them
+comparable with stereo measurements of the same material.
+"""
+import numpy as np
+from scipy.signal import resample_poly, sosfilt
+
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+BLOCK_SECONDS = 0.4  # gating blocks, 75% overlap
+SHORT_TERM_SECONDS = 3.0
+SHORT_TERM_HOP_SECONDS = 0.5
+TRUE_PEAK_CHUNK_SECONDS = 10.0
+
+
+def k_weighting_sos(sr):
+    """BS.1770 K-weighting (high shelf + RLB high-pass) as SOS, designed for any sample rate"""
+    # Stage 1: +4 dB high shelf modelling the head
+    k = np.tan(np.pi * 1681.974450955533 / sr)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0,
+             1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    # Stage 2: revised low-frequency B-curve high-pass
+    k = np.tan(np.pi * 38.13547087602444 / sr)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = [1.0, -2.0, 1.0, 1.0, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    return np.array([shelf, highpass])
+
+
+def _weighted_power(y, sr):
+    """Per-sample K-weighted power summed over channels (float64)"""
+    y = np.atleast_2d(y)
+    z = sosfilt(k_weighting_sos(sr), y.astype(np.float64), axis=-1)
+    power = np.square(z).sum(axis=0)
+    if y.shape[0] == 1:
+        power *= 2  # dual mono
+    return power
+
+
+def _window_means(power, window, hop):
+    """Mean power of every full `window`-sample window, stepping by `hop`"""
+    if len(power) < window:
+        return np.array([power.mean()]) if len(power) else np.zeros(0)
+    cumulative = np.concatenate([[0.0], np.cumsum(power)])
+    starts = np.arange(0, len(power) - window + 1, hop)
+    return (cumulative[starts + window] - cumulative[starts]) / window
+
+
+def _to_lufs(mean_power):
+    return -0.691 + 10 * np.log10(np.maximum(mean_power, 1e-20))
+
+
+def integrated_loudness(y, sr):
+    """Gated integrated loudness in LUFS (ABSOLUTE_GATE_LUFS for silence)"""
+    return _integrated(_weighted_power(y, sr), sr)
+
+
+def _integrated(power, sr):
+    blocks = _window_means(power, int(BLOCK_SECONDS * sr), int(BLOCK_SECONDS * sr / 4))
+    blocks = blocks[_to_lufs(blocks) > ABSOLUTE_GATE_LUFS]
+    if not len(blocks):
+        return ABSOLUTE_GATE_LUFS
+    blocks = blocks[_to_lufs(blocks) > _to_lufs(blocks.mean()) + RELATIVE_GATE_LU]
+    return float(_to_lufs(blocks.mean()))
+
+
+def short_term_loudness(y, sr, hop_seconds=SHORT_TERM_HOP_SECONDS):
+    """Short-term (3 s window) loudness curve in LUFS, one value per hop, floored at the absolute gate"""
+    return _short_term(_weighted_power(y, sr), sr, hop_seconds)
+
+
+def _short_term(power, sr, hop_seconds):
+    curve = _to_lufs(_window_means(power, int(SHORT_TERM_SECONDS * sr), int(hop_seconds * sr)))
+    return np.maximum(curve, ABSOLUTE_GATE_LUFS).astype(np.float32)
+
+
+def true_peak(y, sr):
+    """True peak in dBTP: the sample peak after 4x oversampling (2x at 96 kHz and up)"""
+    y = np.atleast_2d(y)
+    factor = 4 if sr < 96000 else 2
+    # Oversample in chunks, with context on each side so the filter has no edge effects
+    n, step, pad = y.shape[-1], int(TRUE_PEAK_CHUNK_SECONDS * sr), 64
+    peak = 0.0
+    for start in range(0, n, step):
+        stop = min(n, start + step)
+        lo, hi = max(0, start - pad), min(n, stop + pad)
+        upsampled = resample_poly(y[:, lo:hi], factor, 1, axis=-1)
+        inner = upsampled[:, (start - lo) * factor:(stop - lo) * factor]
+        peak = max(peak, float(np.max(np.abs(inner), initial=0.0)))
+    return float(20 * np.log10(max(peak, 1e-10)))
+
+
+def measure(y, sr, hop_seconds=SHORT_TERM_HOP_SECONDS):
+    """Integrated loudness, true peak and short-term curve of one buffer (one K-weighting pass)"""
+    power = _weighted_power(y, sr)
+    return {
+        "loudness_lufs": _integrated(power, sr),
+        "true_peak_dbtp": true_peak(y, sr),
+        "short_term_lufs": _short_term(power, sr, hop_seconds),
+        "short_term_hop_seconds": hop_seconds,
+    }
+
+
+def window_loudness(short_term_lufs, hop_seconds, start=0.0, end=None):
+    """Approximate loudness of [start, end) seconds from a short-term curve, or None if it has no windows there.
+
+    Power-averages the 3 s windows centred inside the range (absolute gate only).
+    """
+    centres = np.arange(len(short_term_lufs)) * hop_seconds + SHORT_TERM_SECONDS / 2
+    inside = centres >= start
+    if end is not None:
+        inside &= centres < end
+    values = np.asarray(short_term_lufs, dtype=np.float64)[inside]
+    values = values[values > ABSOLUTE_GATE_LUFS]
+    if not len(values):
+        return None
+    return float(10 * np.log10(np.mean(np.power(10, values / 10))))
+
+
+def sum_loudness(levels_lufs, gains=None):
+    """Estimated loudness of a sum of uncorrelated signals (stems, or tracks playing together)"""
+    levels = np.asarray(levels_lufs, dtype=np.float64)
+    gains = np.ones_like(levels) if gains is None else np.asarray(gains, dtype=np.float64)
+    power = np.sum(np.square(gains) * np.power(10, levels / 10))
+    return float(10 * np.log10(power)) if power > 0 else ABSOLUTE_GATE_LUFS
+
+
+def gain_to_target(loudness_lufs, target_lufs, max_gain_db):
+    """Linear gain taking `loudness_lufs` to `target_lufs`, boosting by at most `max_gain_db`"""
+    return float(10 ** (min(target_lufs - loudness_lufs, max_gain_db) / 20))
@@ -1,12 +1,11 @@
-from fastapi import FastAPI, Query, BackgroundTasks, Request, Body, Path
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, Query, BackgroundTasks, Request, Body, Path, Header
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List
-# from celery.result import AsyncResult
-# from celery_worker import celery_app
-from audiomack import spotify_search
-# from tasks import download_track_task, process_track_task
+from typing import List, Optional
+from audiomack import spotify_search, spotify_client
+from search_cache import SearchCache, SEARCH_CACHE_MAX_ENTRIES, SEARCH_CACHE_TTL
 import os
 # import certifi
 from dotenv import load_dotenv
@@ -17,10 +16,12 @@ import glob
 import subprocess
 import shutil
 from twilio_auth import router as twilio_auth_router
-# from audio_processor import RiddimAudioProcessor
-from db import get_db_connection, get_stems_by_spotify_id
-import tempfile
-import requests
+from db import get_db_connection, get_stems_by_spotify_id, get_stems_by_spotify_ids, get_pool_stats, close_db_pool, ensure_track_analysis_table, PoolTimeout
+from track_analysis import get_analyses, harmonic_suggestions, get_request_loudness
+from stem_cache import stem_cache, fetch_stem_paths, check_stem_urls
+from mix_cache import mix_cache, mix_cache_key, mix_request_id
+from render_quality import RENDER_QUALITIES
+from mix_graph import spec_urls
 
 app = FastAPI()
 
@@ -36,9 +37,37 @@ app.add_middleware(
 )
 app.include_router(twilio_auth_router)
 
+# Seconds clients wait before retrying when every pooled database connection is busy
+DB_POOL_RETRY_AFTER = os.getenv("DB_POOL_RETRY_AFTER", "1")
+
+@app.exception_handler(PoolTimeout)
+def pool_timeout_handler(request: Request, exc: PoolTimeout):
+    # Load shedding, not a failure: tell clients to come back instead of returning a 500
+    print(f"[DBPool] Shedding {request.url.path}: {exc}")
+    return JSONResponse(
+        {"error": "Server busy, try again shortly"},
+        status_code=503,
+        headers={"Retry-After": DB_POOL_RETRY_AFTER},
+    )
+
+@app.on_event("startup")
+def ensure_schema():
+    try:
+        ensure_track_analysis_table()
+    except Exception as e:
+        print(f"[Startup] Could not ensure track_analysis table: {e}")
+
+@app.on_event("shutdown")
+async def shutdown_pools():
+    close_db_pool()
+    await spotify_client.aclose()
+
 AUDIO_DIR = "storage"
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
+# Identical /search queries share cached results and in-flight Spotify calls
+search_cache = SearchCache(spotify_search, max_entries=SEARCH_CACHE_MAX_ENTRIES, ttl=SEARCH_CACHE_TTL)
+
 class SnippetRequest(BaseModel):
     id: str
     start: float
@@ -67,9 +96,22 @@ class ProfessionalMixRequest(BaseModel):
     track2_urls: List[str]
     track1_time_window: dict
     track2_time_window: dict
+    track1_stem_gains: Optional[List[float]] = None
+    track2_stem_gains: Optional[List[float]] = None
+    track1_stem_transforms: Optional[List[dict]] = None
+    track2_stem_transforms: Optional[List[dict]] = None
     tempo_factor: float = 1.0
     pitch_semitones: float = 0.0
     effects: dict = {}
+    # "preview" or "final": how the mix is rendered; the mix parameters above are the same for both
+    quality: str = "final"
+
+class MixGraphRequest(BaseModel):
+    # Either a node graph or a track list (see mix_graph.py), for any number of tracks
+    graph: Optional[dict] = None
+    tracks: Optional[List[dict]] = None
+    effects: dict = {}
+    quality: str = "final"
 
 class AnalysisResponse(BaseModel):
     tempo: float
@@ -85,7 +127,7 @@ class HarmonicSuggestionsResponse(BaseModel):
     energy_balance: float
 
 @app.get("/search")
-def search_tracks(q: str, page: int = 1, genre: str = None, sort: str = None):
+async def search_tracks(q: str, page: int = 1, genre: str = None, sort: str = None):
     try:
         if not q or not q.strip():
             return {"results": [], "page": page, "total": 0}
@@ -94,11 +136,16 @@ def search_tracks(q: str, page: int = 1, genre: str = None, sort: str = None):
         if len(q) > 200:  # Prevent extremely long queries
             return {"error": "Search query too long"}, 400
             
-        return spotify_search(q, page, genre, sort)
+        return await search_cache.get(q, page, genre, sort)
     except Exception as e:
         print(f"[Search] Error: {e}")
         return {"error": "Search failed", "results": [], "page": page, "total": 0}
 
+@app.get("/search_cache_stats")
+def search_cache_stats():
+    """Hit/miss counters for the /search result cache"""
+    return search_cache.stats()
+
 @app.get("/song/{song_id}")
 def get_song_info(song_id: str):
     return audiomack_song_info(song_id)
@@ -179,36 +226,18 @@ def download_audio(request: Request, background_tasks: BackgroundTasks):
 
 @app.post("/split_snippets")
 def split_snippets(req: SplitSnippetsRequest):
+    # One round trip for the whole request, however many songs it contains
+    song_ids = [song.id for song in req.songs]  # These should be spotify_track_ids
+    print(f"[split_snippets] Looking up stems for spotify_track_ids: {song_ids}")
+    stems_rows = get_stems_by_spotify_ids(song_ids)
+
     results = []
+    missing = []
     for song in req.songs:
-        song_id = song.id  # This should be the spotify_track_id
-        start = song.start
-        end = song.end
-        print(f"[split_snippets] Looking up stems for spotify_track_id: {song_id}")
-        stems_row = get_stems_by_spotify_id(song_id)
+        song_id = song.id
+        stems_row = stems_rows.get(song_id)
         print(f"[split_snippets] DB result for {song_id}: {stems_row}")
-        
-        # If not found in DB, let's see what's available
-        if not stems_row:
-            print(f"[split_snippets] Spotify track ID {song_id} not found in database")
-            # Let's check what's actually in the database
-            try:
-                conn = get_db_connection()
-                with conn.cursor() as cur:
-                    cur.execute("SELECT spotify_track_id, title FROM stems LIMIT 5")
-                    available_tracks = cur.fetchall()
-                    print(f"[split_snippets] Available tracks in DB: {available_tracks}")
-                conn.close()
-            except Exception as e:
-                print(f"[split_snippets] Error checking database: {e}")
-            
-            # For now, return a 404 with more helpful error message
-            return JSONResponse({
-                "error": f"Stems not found in database for Spotify track ID: {song_id}",
-                "message": "This track hasn't been processed yet. Only tracks that have been processed and added to the database can be used for mixing.",
-                "available_tracks": available_tracks if 'available_tracks' in locals() else []
-            }, status_code=404)
-        
+
         # Only check for the four main stems
         if stems_row and all(stems_row.get(k) for k in ["vocals_url", "drums_url", "bass_url", "other_url"]):
             results.append({
@@ -218,10 +247,22 @@ def split_snippets(req: SplitSnippetsRequest):
                 "bass_url": stems_row["bass_url"],
                 "other_url": stems_row["other_url"],
                 "full_song_url": stems_row.get("full_song_url"),
+                # Pass through as track*_time_window so mix renders decode only this range
+                "time_window": {"start": song.start, "end": song.end},
             })
-            continue
-        # If not found in DB, return error (do not fallback to local processing)
-        return JSONResponse({"error": f"Stems not found in database for {song_id}"}, status_code=404)
+        elif not stems_row:
+            print(f"[split_snippets] Spotify track ID {song_id} not found in database")
+            missing.append({"id": song_id, "error": f"Stems not found in database for Spotify track ID: {song_id}"})
+        else:
+            missing.append({"id": song_id, "error": f"Stems not found in database for {song_id}"})
+
+    # If any song is missing, return error (do not fallback to local processing)
+    if missing:
+        return JSONResponse({
+            "error": missing[0]["error"],
+            "message": "This track hasn't been processed yet. Only tracks that have been processed and added to the database can be used for mixing.",
+            "missing": missing,
+        }, status_code=404)
     return {"results": results}
 
 @app.get("/audio/{youtube_id}")
@@ -238,8 +279,18 @@ def get_audio(youtube_id: str):
 
 @app.get("/progress/{task_id}")
 def get_progress(task_id: str):
+    """State of a Celery task; render jobs also report their current stage and progress (0-1)"""
+    if not RENDER_JOBS_AVAILABLE:
+        return JSONResponse({"error": "Background jobs disabled"}, status_code=503)
     result = AsyncResult(task_id, app=celery_app)
-    return {"status": result.status, "result": result.result}
+    if result.failed():
+        return {"status": result.status, "error": str(result.result)}
+    progress = {"status": result.status, "result": result.result}
+    if result.status == "PROGRESS":
+        progress.update(result.info)
+    elif result.successful():
+        progress.update({"stage": "done", "progress": 1.0})
+    return progress
 
 @app.get("/file/{file_path:path}")
 def get_file(file_path: str = Path(..., description="Relative path under storage/")):
@@ -296,50 +347,173 @@ def youtube_search(title: str, artist: str):
             print(f"[YouTube Debug] {artist} - {title} => No result found")
             return {"error": "No YouTube result found"}
 
-# Initialize the professional audio processor
-# audio_processor = RiddimAudioProcessor()  # Disabled for Railway deployment
+# Initialize the professional audio processor (heavy deps are skipped on the lightweight Railway build)
+try:
+    from audio_processor import RiddimAudioProcessor
+    from audio_cache import AudioBufferCache
+    from audio_encoder import MP3_STREAMING_AVAILABLE, encode_audio
+    from stem_store import stem_store
+    # One processor per render quality, sharing decoded audio (cache keys include the sample rate)
+    audio_buffer_cache = AudioBufferCache()
+    audio_processors = {
+        name: RiddimAudioProcessor.for_quality(quality, audio_buffer_cache, stem_store)
+        for name, quality in RENDER_QUALITIES.items()
+    }
+    audio_processor = audio_processors["final"]
+except ImportError as e:
+    print(f"[AudioProcessor] Disabled, missing dependency: {e}")
+    audio_processors = {}
+    audio_processor = None
+    MP3_STREAMING_AVAILABLE = False
+
+def mix_headers(cache_key):
+    return {"ETag": f'"{cache_key}"', "Content-Disposition": 'attachment; filename="your_mix.mp3"'}
+
+def cached_mix_response(cache_key, if_none_match=None):
+    """304 when the client already has this mix, the cached file when we do, else None"""
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")] if if_none_match else []
+    if f'"{cache_key}"' in tags:
+        mix_cache.record_not_modified()
+        return Response(status_code=304, headers={"ETag": f'"{cache_key}"'})
+    cached_path = mix_cache.get(cache_key)
+    if not cached_path:
+        return None
+    # "*" matches any current representation, so it only applies once the mix exists
+    if "*" in tags:
+        mix_cache.record_not_modified()
+        return Response(status_code=304, headers={"ETag": f'"{cache_key}"'})
+    return FileResponse(cached_path, media_type="audio/mpeg", headers=mix_headers(cache_key))
+
+def stream_mix_response(processor, plan, cache_key):
+    """Stream a mix plan as MP3 while it renders, teeing the bytes into the mix cache"""
+    return StreamingResponse(
+        mix_cache.tee(cache_key, processor.stream_mix(plan)),
+        media_type="audio/mpeg",
+        headers=mix_headers(cache_key),
+    )
 
-@app.post("/analyze_audio")
-def analyze_audio(audio_url: str):
-    """Analyze audio file from a GCS URL using librosa for tempo, key, energy, etc."""
-    # TEMPORARY: Return dummy data for Railway deployment
+# Render jobs run on Celery workers (not installed on the lightweight Railway build)
+try:
+    from celery.result import AsyncResult
+    from celery_worker import celery_app, queue_depth, claim_render_job, release_render_job, RENDER_QUEUES
+    from tasks import download_track_task, process_track_task, render_mix_task
+    RENDER_JOBS_AVAILABLE = True
+except ImportError as e:
+    print(f"[RenderJobs] Disabled, missing dependency: {e}")
+    RENDER_JOBS_AVAILABLE = False
+
+# Queued renders per quality before new submissions get 429 + Retry-After
+RENDER_QUEUE_MAX_DEPTH = int(os.getenv("RENDER_QUEUE_MAX_DEPTH", "20"))
+RENDER_QUEUE_RETRY_AFTER = os.getenv("RENDER_QUEUE_RETRY_AFTER", "10")  # seconds
+
+def stem_urls_error(urls):
+    """400 response when a mix request names anything but stems in the stems bucket, else None"""
+    try:
+        check_stem_urls(urls)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return None
+
+def job_response(job_id, status_code=202):
+    return JSONResponse({
+        "job_id": job_id,
+        "progress_url": f"/progress/{job_id}",
+        "result_url": f"/mix_jobs/{job_id}/result",
+    }, status_code=status_code)
+
+def submit_render_job(kind, quality, track1_urls, track2_urls, params):
+    """Queue a mix render (previews ahead of final exports), or join the identical job already submitted"""
+    if not RENDER_JOBS_AVAILABLE:
+        return JSONResponse({"error": "Background rendering disabled"}, status_code=503)
+    job_id = mix_request_id(kind, track1_urls, track2_urls, dict(params, quality=quality))
+    existing = AsyncResult(job_id, app=celery_app)
+    if existing.status in ("STARTED", "PROGRESS"):
+        return job_response(job_id)
+    if existing.successful() and mix_cache.get(existing.result["cache_key"]):
+        return job_response(job_id, status_code=200)
+
+    queue = RENDER_QUEUES[quality]
+    try:
+        if existing.ready():
+            # Failed, or its mix was evicted since: forget it and render again
+            existing.forget()
+            release_render_job(job_id)
+        # Still waiting in the queue (PENDING, like an unknown id) if already claimed
+        if not claim_render_job(job_id):
+            return job_response(job_id)
+        depth = 0 if celery_app.conf.task_always_eager else queue_depth(queue)
+        if depth >= RENDER_QUEUE_MAX_DEPTH:
+            release_render_job(job_id)
+            print(f"[RenderJobs] Rejecting {quality} render, {depth} already queued")
+            return JSONResponse(
+                {"error": "Render queue is full, try again shortly", "queue_depth": depth},
+                status_code=429,
+                headers={"Retry-After": RENDER_QUEUE_RETRY_AFTER},
+            )
+        render_mix_task.apply_async(args=(kind, quality, track1_urls, track2_urls, params), task_id=job_id, queue=queue)
+    except Exception as e:
+        print(f"[RenderJobs] Broker unavailable: {e}")
+        try:
+            release_render_job(job_id)
+        except Exception:
+            pass
+        return JSONResponse({"error": "Render queue unavailable"}, status_code=503)
+    print(f"[RenderJobs] Queued {quality} {kind} render {job_id[:12]} ({depth} ahead)")
+    return job_response(job_id)
+
+def stems_mix_params(request: ProfessionalMixRequest):
+    return {
+        "tempo_factor": request.tempo_factor,
+        "pitch_semitones": request.pitch_semitones,
+        "effects": request.effects,
+        "track1_time_window": request.track1_time_window,
+        "track2_time_window": request.track2_time_window,
+        "track1_stem_gains": request.track1_stem_gains,
+        "track2_stem_gains": request.track2_stem_gains,
+        "track1_stem_transforms": request.track1_stem_transforms,
+        "track2_stem_transforms": request.track2_stem_transforms
+    }
+
+def crossfade_mix_params(data):
     return {
-        "tempo": 120.0,
-        "key": 0.0,
-        "energy": 0.5,
-        "duration": 180.0,
-        "beats_count": 480
+        "track1_delay": data.get('track1_delay', 0),
+        "track2_delay": data.get('track2_delay', 0),
+        "crossfade_duration": data.get('crossfade_duration', 3),
+        "crossfade_style": data.get('crossfade_style', 'linear'),
     }
 
+def graph_mix_params(request: MixGraphRequest):
+    params = {"graph": request.graph, "tracks": request.tracks, "effects": request.effects}
+    return {name: value for name, value in params.items() if value}
+
+@app.post("/analyze_audio")
+def analyze_audio(audio_url: str):
+    """Analyze audio file from a GCS URL: tempo, key, energy, etc.
+
+    Served from the precomputed track_analysis table; analyzed and stored on a miss.
+    """
+    try:
+        analysis = get_analyses([audio_url], audio_processor)[0]
+        return {k: analysis[k] for k in ("tempo", "key", "energy", "duration", "beats_count")}
+    except PoolTimeout:
+        raise  # answered with 503 + Retry-After by pool_timeout_handler
+    except Exception as e:
+        print(f"[AnalyzeAudio] Error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
 @app.post("/process_audio")
 def process_audio(audio_url: str, tempo_factor: float = 1.0, pitch_semitones: float = 0.0, effects: dict = {}):
     """Process audio file from a GCS URL with professional effects using pyrubberband"""
-    temp_path = None
-    processed_path = None
     try:
-        # Download to temp file
-        r = requests.get(audio_url, stream=True)
-        tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        for chunk in r.iter_content(chunk_size=8192):
-            tmp.write(chunk)
-        tmp.close()
-        temp_path = tmp.name
-        processed_path = audio_processor.professional_process(
-            temp_path, 
-            tempo_factor=tempo_factor, 
-            pitch_semitones=pitch_semitones, 
-            effects=effects
-        )
-        # Return processed file as a download
-        return FileResponse(processed_path, media_type="audio/mpeg")
+        # Served from the local stem cache; downloaded only on a miss
+        source_path = stem_cache.fetch(audio_url)
+        # Processed and encoded in memory, so nothing is written to disk
+        y, sr = audio_processor.load_audio(source_path)
+        processed = audio_processor.process_buffer(y, tempo_factor, pitch_semitones, effects)
+        return Response(encode_audio(processed, sr, "wav"), media_type="audio/wav")
     except Exception as e:
         print(f"[ProcessAudio] Error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
-    finally:
-        if temp_path and os.path.exists(temp_path):
-            os.remove(temp_path)
-        if processed_path and os.path.exists(processed_path):
-            os.remove(processed_path)
 
 @app.post("/beat_match")
 def beat_match_tracks(track1_file: str, track2_file: str):
@@ -369,31 +543,16 @@ def beat_match_tracks(track1_file: str, track2_file: str):
 @app.post("/harmonic_suggestions")
 def get_harmonic_suggestions(track1_url: str, track2_url: str):
     """Get harmonic mixing suggestions for two tracks from GCS URLs"""
-    temp1 = temp2 = None
     try:
-        # Download both files to temp
-        r1 = requests.get(track1_url, stream=True)
-        tmp1 = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        for chunk in r1.iter_content(chunk_size=8192):
-            tmp1.write(chunk)
-        tmp1.close()
-        temp1 = tmp1.name
-        r2 = requests.get(track2_url, stream=True)
-        tmp2 = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        for chunk in r2.iter_content(chunk_size=8192):
-            tmp2.write(chunk)
-        tmp2.close()
-        temp2 = tmp2.name
-        suggestions = audio_processor.harmonic_mix_suggestions(temp1, temp2)
+        # Precomputed analyses (one lookup for both); only misses are downloaded and analyzed
+        analysis1, analysis2 = get_analyses([track1_url, track2_url], audio_processor)
+        suggestions = harmonic_suggestions(analysis1, analysis2)
         return suggestions
+    except PoolTimeout:
+        raise  # answered with 503 + Retry-After by pool_timeout_handler
     except Exception as e:
         print(f"[HarmonicSuggestions] Error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
-    finally:
-        if temp1 and os.path.exists(temp1):
-            os.remove(temp1)
-        if temp2 and os.path.exists(temp2):
-            os.remove(temp2)
 
 @app.post("/create_professional_mix")
 def create_professional_mix(request: MixRequest):
@@ -413,66 +572,76 @@ def create_professional_mix(request: MixRequest):
             "effects": request.effects
         } if request.tempo_factor != 1.0 or request.pitch_semitones != 0.0 or request.effects else None
         
-        mixed_path = audio_processor.create_professional_mix(track1_path, track2_path, mix_params)
-        
-        # Return relative path for serving
-        relative_path = os.path.relpath(mixed_path, AUDIO_DIR)
-        return {"mixed_file": relative_path}
+        # Rendered in memory, so concurrent requests can't overwrite each other's output
+        mixed = audio_processor.create_professional_mix(track1_path, track2_path, mix_params)
+        return Response(mixed, media_type="audio/wav",
+                        headers={"Content-Disposition": 'attachment; filename="professional_mix.wav"'})
     except Exception as e:
         print(f"[ProfessionalMix] Error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
 
 @app.post("/create_mix_from_urls")
-def create_mix_from_urls(request: ProfessionalMixRequest):
+def create_mix_from_urls(request: ProfessionalMixRequest, if_none_match: Optional[str] = Header(None)):
     """Create a professional mix from GCS URLs with multiple stems and time windows"""
-    temp_files = []
+    if request.quality not in RENDER_QUALITIES:
+        return JSONResponse({"error": f"quality must be one of {sorted(RENDER_QUALITIES)}"}, status_code=400)
+    invalid = stem_urls_error(request.track1_urls + request.track2_urls)
+    if invalid is not None:
+        return invalid
+    if audio_processor is None:
+        # Audio processing dependencies aren't installed on the lightweight Railway build
+        return JSONResponse(
+            {"error": "Audio processing temporarily disabled on Railway deployment"}, 
+            status_code=503
+        )
     try:
-        print(f"[CreateMixFromUrls] Creating mix with {len(request.track1_urls)} stems for track1 and {len(request.track2_urls)} stems for track2")
+        print(f"[CreateMixFromUrls] Creating {request.quality} mix with {len(request.track1_urls)} stems for track1 and {len(request.track2_urls)} stems for track2")
         
-        # Download all stem files to temp
+        # Fetch all stem files concurrently (bounded by the slowest stem); hot stems come from local disk
         all_urls = request.track1_urls + request.track2_urls
-        temp_paths = []
+        stem_paths = stem_cache.fetch_all(all_urls)
         
-        for url in all_urls:
-            r = requests.get(url, stream=True)
-            tmp = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-            for chunk in r.iter_content(chunk_size=8192):
-                tmp.write(chunk)
-            tmp.close()
-            temp_paths.append(tmp.name)
-            temp_files.append(tmp.name)
-        
-        # Split temp paths for each track
-        track1_temp_paths = temp_paths[:len(request.track1_urls)]
-        track2_temp_paths = temp_paths[len(request.track1_urls):]
+        # Split local paths for each track
+        track1_paths = stem_paths[:len(request.track1_urls)]
+        track2_paths = stem_paths[len(request.track1_urls):]
         
         # Create mix parameters
-        mix_params = {
-            "tempo_factor": request.tempo_factor,
-            "pitch_semitones": request.pitch_semitones,
-            "effects": request.effects,
-            "track1_time_window": request.track1_time_window,
-            "track2_time_window": request.track2_time_window
-        }
+        mix_params = stems_mix_params(request)
+        
+        # Stored stem loudness sets the mix gain up front, so it's part of the cache key
+        stem_loudness = get_request_loudness("stems", request.track1_urls, request.track2_urls, mix_params)
         
-        # Create the mix using the audio processor
-        mixed_path = audio_processor.create_mix_from_stems(
-            track1_temp_paths, 
-            track2_temp_paths, 
-            mix_params
+        # Identical mixes (same stem content, parameters and levels) are served from the mix cache
+        cache_key = mix_cache_key("stems", track1_paths, track2_paths,
+                                  dict(mix_params, quality=request.quality, stem_loudness=stem_loudness))
+        cached = cached_mix_response(cache_key, if_none_match)
+        if cached is not None:
+            print(f"[CreateMixFromUrls] Serving cached mix {cache_key[:12]}")
+            return cached
+        
+        processor = audio_processors[request.quality]
+        if MP3_STREAMING_AVAILABLE:
+            # Decode and sum up front (errors still return JSON), then render + encode while streaming
+            plan = processor.plan_mix_from_stems(track1_paths, track2_paths, mix_params, stem_loudness)
+            return stream_mix_response(processor, plan, cache_key)
+        
+        # Create the mix using the audio processor (encoded in memory)
+        mixed = processor.create_mix_from_stems(
+            track1_paths, 
+            track2_paths, 
+            mix_params,
+            stem_loudness
         )
+        mix_cache.put_bytes(cache_key, mixed)
         
-        # Return the mixed file as a download
-        return FileResponse(mixed_path, media_type="audio/mpeg", filename="your_mix.mp3")
+        # Return the mix as a download
+        return Response(mixed, media_type="audio/mpeg", headers=mix_headers(cache_key))
         
+    except PoolTimeout:
+        raise  # answered with 503 + Retry-After by pool_timeout_handler
     except Exception as e:
         print(f"[CreateMixFromUrls] Error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500)
-    finally:
-        # Clean up temp files
-        for temp_file in temp_files:
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
 
 @app.post("/cleanup_temp_files")
 def cleanup_temp_files():
@@ -489,35 +658,193 @@ async def create_mix_with_offset_and_crossfade(request: Request):
     data = await request.json()
     track1_urls = data.get('track1_urls')
     track2_urls = data.get('track2_urls')
-    track1_delay = data.get('track1_delay', 0)
-    track2_delay = data.get('track2_delay', 0)
-    crossfade_duration = data.get('crossfade_duration', 3)
-    crossfade_style = data.get('crossfade_style', 'linear')
+    mix_params = crossfade_mix_params(data)
+    track1_delay, track2_delay = mix_params["track1_delay"], mix_params["track2_delay"]
+    crossfade_duration, crossfade_style = mix_params["crossfade_duration"], mix_params["crossfade_style"]
+    quality = data.get('quality', 'final')
 
     print(f"[CreateMixWithOffset] Received delays: track1={track1_delay}s, track2={track2_delay}s")
     print(f"[CreateMixWithOffset] Crossfade: {crossfade_duration}s, style={crossfade_style}")
     print(f"[CreateMixWithOffset] Track1 URLs: {len(track1_urls) if track1_urls else 0}")
     print(f"[CreateMixWithOffset] Track2 URLs: {len(track2_urls) if track2_urls else 0}")
 
-    # TEMPORARY: Return error for Railway deployment (audio processing disabled)
-    return JSONResponse(
-        {"error": "Audio processing temporarily disabled on Railway deployment"}, 
-        status_code=503
+    if not isinstance(track1_urls, list) or not isinstance(track2_urls, list) or not track1_urls or not track2_urls:
+        return JSONResponse({"error": "track1_urls and track2_urls are required"}, status_code=400)
+    if quality not in RENDER_QUALITIES:
+        return JSONResponse({"error": f"quality must be one of {sorted(RENDER_QUALITIES)}"}, status_code=400)
+    invalid = stem_urls_error(track1_urls + track2_urls)
+    if invalid is not None:
+        return invalid
+    if audio_processor is None:
+        # Audio processing dependencies aren't installed on the lightweight Railway build
+        return JSONResponse(
+            {"error": "Audio processing temporarily disabled on Railway deployment"}, 
+            status_code=503
+        )
+
+    try:
+        # Resolve stems through the stem cache first: the mix cache key covers their content
+        stem_paths = await run_in_threadpool(fetch_stem_paths, track1_urls + track2_urls)
+        track1_paths, track2_paths = stem_paths[:len(track1_urls)], stem_paths[len(track1_urls):]
+        stem_loudness = await run_in_threadpool(get_request_loudness, "crossfade", track1_urls, track2_urls, mix_params)
+        cache_key = mix_cache_key("crossfade", track1_paths, track2_paths,
+                                  dict(mix_params, quality=quality, stem_loudness=stem_loudness))
+        cached = cached_mix_response(cache_key, request.headers.get("if-none-match"))
+        if cached is not None:
+            print(f"[CreateMixWithOffset] Serving cached mix {cache_key[:12]}")
+            return cached
+
+        processor = audio_processors[quality]
+        mix_args = (track1_paths, track2_paths, track1_delay, track2_delay, crossfade_duration, crossfade_style,
+                    stem_loudness)
+        if MP3_STREAMING_AVAILABLE:
+            plan = await run_in_threadpool(processor.plan_mix_with_offset_and_crossfade, *mix_args)
+            return stream_mix_response(processor, plan, cache_key)
+        mixed = await run_in_threadpool(processor.create_mix_with_offset_and_crossfade, *mix_args)
+        await run_in_threadpool(mix_cache.put_bytes, cache_key, mixed)
+        return Response(mixed, media_type="audio/mpeg", headers=mix_headers(cache_key))
+    except PoolTimeout:
+        raise  # answered with 503 + Retry-After by pool_timeout_handler
+    except Exception as e:
+        print(f"[CreateMixWithOffset] Error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.post("/create_mix_graph")
+def create_mix_graph(request: MixGraphRequest, if_none_match: Optional[str] = Header(None)):
+    """Create a mix of any number of tracks from a mix graph, rendering only the samples that reach the output"""
+    if request.quality not in RENDER_QUALITIES:
+        return JSONResponse({"error": f"quality must be one of {sorted(RENDER_QUALITIES)}"}, status_code=400)
+    mix_params = graph_mix_params(request)
+    try:
+        urls = spec_urls(mix_params)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if audio_processor is None:
+        return JSONResponse({"error": "Audio processing disabled"}, status_code=503)
+    try:
+        print(f"[CreateMixGraph] Creating {request.quality} mix from {len(urls)} sources")
+        stem_paths = fetch_stem_paths(urls)
+        stem_loudness = get_request_loudness("graph", urls, [], mix_params)
+        cache_key = mix_cache_key("graph", stem_paths, [],
+                                  dict(mix_params, quality=request.quality, stem_loudness=stem_loudness))
+        cached = cached_mix_response(cache_key, if_none_match)
+        if cached is not None:
+            print(f"[CreateMixGraph] Serving cached mix {cache_key[:12]}")
+            return cached
+
+        processor = audio_processors[request.quality]
+        sources = dict(zip(urls, stem_paths))
+        try:
+            plan = processor.plan_mix_graph(mix_params, sources, stem_loudness)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+        if MP3_STREAMING_AVAILABLE:
+            return stream_mix_response(processor, plan, cache_key)
+        mixed = processor.render_plan(plan)
+        mix_cache.put_bytes(cache_key, mixed)
+        return Response(mixed, media_type="audio/mpeg", headers=mix_headers(cache_key))
+    except PoolTimeout:
+        raise  # answered with 503 + Retry-After by pool_timeout_handler
+    except Exception as e:
+        print(f"[CreateMixGraph] Error: {e}")
+        return JSONResponse({"error": str(e)}, status_code=500)
+
+@app.post("/create_mix_from_urls/jobs")
+def submit_mix_from_urls_job(request: ProfessionalMixRequest):
+    """Queue a /create_mix_from_urls render; poll /progress/{job_id}, then fetch /mix_jobs/{job_id}/result"""
+    if request.quality not in RENDER_QUALITIES:
+        return JSONResponse({"error": f"quality must be one of {sorted(RENDER_QUALITIES)}"}, status_code=400)
+    invalid = stem_urls_error(request.track1_urls + request.track2_urls)
+    if invalid is not None:
+        return invalid
+    return submit_render_job("stems", request.quality, request.track1_urls, request.track2_urls, stems_mix_params(request))
+
+@app.post("/create_mix_with_offset_and_crossfade/jobs")
+async def submit_mix_with_offset_and_crossfade_job(request: Request):
+    """Queue a /create_mix_with_offset_and_crossfade render (same JSON body)"""
+    data = await request.json()
+    track1_urls = data.get('track1_urls')
+    track2_urls = data.get('track2_urls')
+    quality = data.get('quality', 'final')
+    if not isinstance(track1_urls, list) or not isinstance(track2_urls, list) or not track1_urls or not track2_urls:
+        return JSONResponse({"error": "track1_urls and track2_urls are required"}, status_code=400)
+    if quality not in RENDER_QUALITIES:
+        return JSONResponse({"error": f"quality must be one of {sorted(RENDER_QUALITIES)}"}, status_code=400)
+    invalid = stem_urls_error(track1_urls + track2_urls)
+    if invalid is not None:
+        return invalid
+    return await run_in_threadpool(
+        submit_render_job, "crossfade", quality, track1_urls, track2_urls, crossfade_mix_params(data)
     )
 
+@app.post("/create_mix_graph/jobs")
+def submit_mix_graph_job(request: MixGraphRequest):
+    """Queue a /create_mix_graph render (same JSON body)"""
+    if request.quality not in RENDER_QUALITIES:
+        return JSONResponse({"error": f"quality must be one of {sorted(RENDER_QUALITIES)}"}, status_code=400)
+    mix_params = graph_mix_params(request)
+    try:
+        urls = spec_urls(mix_params)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    return submit_render_job("graph", request.quality, urls, [], mix_params)
+
+@app.get("/mix_jobs/{job_id}/result")
+def get_mix_job_result(job_id: str, if_none_match: Optional[str] = Header(None)):
+    """The rendered mix of a finished job, served from the mix cache"""
+    if not RENDER_JOBS_AVAILABLE:
+        return JSONResponse({"error": "Background rendering disabled"}, status_code=503)
+    result = AsyncResult(job_id, app=celery_app)
+    if result.failed():
+        return JSONResponse({"error": str(result.result)}, status_code=500)
+    if not result.successful():
+        return JSONResponse({"status": result.status, "progress_url": f"/progress/{job_id}"}, status_code=202)
+    cached = cached_mix_response(result.result["cache_key"], if_none_match)
+    if cached is None:
+        # Evicted from the mix cache since it rendered; resubmitting renders it again
+        return JSONResponse({"error": "Mix no longer cached, submit the job again"}, status_code=410)
+    return cached
+
 @app.get("/test_db")
 def test_db():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1 AS result;")
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-        return {"success": True, "result": result}
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1 AS result;")
+                result = cur.fetchone()
+        return {"success": True, "result": result, "pool": get_pool_stats()}
     except Exception as e:
         return {"success": False, "error": str(e)}
 
+@app.get("/stem_cache_stats")
+def stem_cache_stats():
+    """Hit rate and bytes saved by the local stem cache"""
+    return stem_cache.stats()
+
+@app.get("/mix_cache_stats")
+def mix_cache_stats():
+    """Hit rate and size of the rendered-mix cache"""
+    return mix_cache.stats()
+
+@app.get("/stem_store_stats")
+def stem_store_stats():
+    """Size and hit rate of the memory-mapped decoded stem store"""
+    if audio_processor is None or audio_processor.stem_store is None:
+        return JSONResponse({"error": "Stem store disabled"}, status_code=503)
+    return audio_processor.stem_store.stats()
+
+@app.get("/audio_cache_stats")
+def audio_cache_stats():
+    """Memory use and hit rate of the processor's decoded-audio cache"""
+    if audio_processor is None:
+        return JSONResponse({"error": "Audio processing disabled"}, status_code=503)
+    return audio_processor.buffer_cache.stats()
+
+@app.get("/db_pool_stats")
+def db_pool_stats():
+    """Connection pool metrics: in-use, waiting and checkout latency"""
+    return get_pool_stats()
+
 @app.get("/")
 def health_check():
     """Health check endpoint for Railway"""
@@ -527,12 +854,13 @@ def health_check():
 def get_available_tracks():
     """Get list of tracks available in the database for mixing"""
     try:
-        conn = get_db_connection()
-        with conn.cursor() as cur:
-            cur.execute("SELECT spotify_track_id, track_name, artist_names FROM stems ORDER BY track_name LIMIT 50")
-            tracks = cur.fetchall()
-        conn.close()
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT spotify_track_id, track_name, artist_names FROM stems ORDER BY track_name LIMIT 50")
+                tracks = cur.fetchall()
         return {"tracks": tracks}
+    except PoolTimeout:
+        raise  # answered with 503 + Retry-After by pool_timeout_handler
     except Exception as e:
         print(f"[AvailableTracks] Error: {e}")
         return JSONResponse({"error": str(e)}, status_code=500) 
\ No newline at end of file
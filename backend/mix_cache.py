@@ -0,0 +1,123 @@
+import os
+import json
+import hashlib
+import tempfile
+from stem_cache import LocalFileCache, stem_cache
+
+MIX_CACHE_DIR = os.getenv("MIX_CACHE_DIR", "mix_cache")
+MIX_CACHE_MAX_BYTES = int(os.getenv("MIX_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))  # 2 GB
+# Bump when rendering changes so mixes cached by an older engine aren't served
+MIX_RENDER_VERSION = "3"
+
+
+def _stem_identity(path):
+    """Content identity of a local stem: cache blobs are content-addressed, other files use their stat"""
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(stem_cache.cache_dir):
+        return os.path.basename(path)
+    st = os.stat(path)
+    return [os.path.realpath(path), st.st_mtime_ns, st.st_size]
+
+
+def mix_cache_key(kind, track1_stems, track2_stems, params):
+    """Canonical sha256 of a full mix specification.
+
+    `track*_stems` are local stem paths (as returned by the stem cache), so a
+    re-processed stem at the same URL produces a new key. `params` must be
+    JSON-serializable; key order doesn't matter.
+    """
+    spec = {
+        "version": MIX_RENDER_VERSION,
+        "kind": kind,
+        "track1": [_stem_identity(path) for path in track1_stems],
+        "track2": [_stem_identity(path) for path in track2_stems],
+        "params": params,
+    }
+    encoded = json.dumps(spec, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def mix_request_id(kind, track1_urls, track2_urls, params):
+    """Canonical sha256 of a mix request as submitted (stem URLs, not content).
+
+    Used as the render job id so resubmitting the same mix joins the job
+    already in flight instead of queueing a duplicate render.
+    """
+    spec = {"kind": kind, "track1": list(track1_urls), "track2": list(track2_urls), "params": params}
+    encoded = json.dumps(spec, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class MixCache(LocalFileCache):
+    """Rendered mixes on local disk, keyed by mix_cache_key and LRU-evicted.
+
+    Streamed renders are teed into the cache as they are sent, and only
+    committed once the whole stream has been produced, so an aborted render
+    never leaves a truncated mix behind.
+    """
+
+    def __init__(self, cache_dir=MIX_CACHE_DIR, max_bytes=MIX_CACHE_MAX_BYTES):
+        super().__init__(cache_dir, max_bytes)
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _path(self, key):
+        return self.path_for(f"{key}.mp3")
+
+    def get(self, key):
+        """Path of the cached mix for `key`, or None"""
+        path = self._path(key)
+        if self.touch(path):
+            with self._stats_lock:
+                self.hits += 1
+            return path
+        with self._stats_lock:
+            self.misses += 1
+        return None
+
+    def record_not_modified(self):
+        with self._stats_lock:
+            self.not_modified += 1
+
+    def _commit(self, key, tmp_path):
+        size = os.path.getsize(tmp_path)
+        # Concurrent renders of one key produce identical bytes, so the last replace wins harmlessly
+        os.replace(tmp_path, self._path(key))
+        with self._stats_lock:
+            self.current_bytes += size
+        self.evict()
+
+    def put_bytes(self, key, data):
+        """Store a mix rendered in memory"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".fill-")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        self._commit(key, tmp_path)
+
+    def tee(self, key, chunks):
+        """Yield `chunks` unchanged while writing them to the cache entry for `key`"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".fill-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    yield chunk
+            self._commit(key, tmp_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def stats(self):
+        stats = super().stats()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            stats.update({
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            })
+        return stats
+
+
+mix_cache = MixCache()
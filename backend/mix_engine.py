@@ -0,0 +1,203 @@
+"""Sample-buffer mixing: place float32 tracks at offsets in one output buffer.
+
+Tracks are (channels, n_samples) arrays; a mono (1, n) track is broadcast
+into a stereo output. Each track is added in place into a single
+preallocated buffer, and crossfades are gain curves applied only over the
+samples they cover, so no full-length intermediate copies are made.
+"""
+from functools import lru_cache
+import numpy as np
+
+# Request-facing crossfade styles -> curve shapes
+CROSSFADE_SHAPES = {
+    "linear": "linear",
+    "equal-power": "equal-power",
+    "s-curve": "s-curve",
+    "ease-in": "log",
+    "ease-out": "exp",
+    "log": "log",
+    "exp": "exp",
+}
+
+
+@lru_cache(maxsize=64)
+def fade_in_curve(shape: str, n: int) -> np.ndarray:
+    """Read-only float32 gain curve rising from 0 to 1 over n samples"""
+    t = np.linspace(0.0, 1.0, n, dtype=np.float64)
+    if shape == "linear":
+        curve = t
+    elif shape == "equal-power":
+        curve = np.sin(t * np.pi / 2)
+    elif shape == "s-curve":
+        curve = 0.5 - 0.5 * np.cos(np.pi * t)
+    elif shape == "log":
+        curve = np.log1p(9 * t) / np.log(10)
+    elif shape == "exp":
+        curve = (np.power(10.0, t) - 1) / 9
+    else:
+        raise ValueError(f"Unknown fade shape: {shape}")
+    curve = curve.astype(np.float32)
+    curve.flags.writeable = False
+    return curve
+
+
+def crossfade_curves(style: str, n: int):
+    """(fade_out, fade_in) gain curves of n samples for a crossfade style"""
+    fade_in = fade_in_curve(CROSSFADE_SHAPES.get(style, "linear"), n)
+    # Mirrored, so equal-power gives cos/sin and the others stay symmetric
+    return fade_in[::-1], fade_in
+
+
+def as_channels(y: np.ndarray) -> np.ndarray:
+    """View a librosa-style buffer as (channels, n_samples)"""
+    return y[np.newaxis, :] if y.ndim == 1 else y
+
+
+class PlacedTrack:
+    """A (channels, n) buffer positioned `offset` samples into the output.
+
+    `ramps` are (start_sample, gains) pairs in output time; inside a ramp
+    the track is scaled by the curve, elsewhere by the constant `gain`.
+    """
+
+    def __init__(self, samples: np.ndarray, offset: int = 0, gain: float = 1.0):
+        self.samples = as_channels(samples)
+        self.offset = int(offset)
+        self.gain = gain
+        self.ramps = []
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.samples.shape[-1]
+
+    def add_ramp(self, start: int, gains: np.ndarray):
+        self.ramps.append((int(start), gains))
+        self.ramps.sort(key=lambda ramp: ramp[0])
+
+
+def mix_into(out: np.ndarray, start: int, tracks) -> np.ndarray:
+    """Add every track's contribution to output samples [start, start + len(out)) in place"""
+    stop = start + out.shape[-1]
+    for track in tracks:
+        lo, hi = max(start, track.offset), min(stop, track.end)
+        if lo >= hi:
+            continue
+        seg = track.samples[..., lo - track.offset:hi - track.offset]
+
+        def add(a, b, gains):
+            dst = out[..., a - start:b - start]
+            src = seg[..., a - lo:b - lo]
+            if gains is None:
+                dst += src
+            else:
+                dst += src * gains
+
+        constant = None if track.gain == 1.0 else np.float32(track.gain)
+        pos = lo
+        for ramp_start, curve in track.ramps:
+            a, b = max(pos, ramp_start), min(hi, ramp_start + len(curve))
+            if a >= b:
+                continue
+            if pos < a:
+                add(pos, a, constant)
+            gains = curve[a - ramp_start:b - ramp_start]
+            add(a, b, gains if constant is None else gains * constant)
+            pos = b
+        if pos < hi:
+            add(pos, hi, constant)
+    return out
+
+
+def mix(tracks, length: int = None, channels: int = None) -> np.ndarray:
+    """Render tracks into one preallocated (channels, length) float32 buffer"""
+    if length is None:
+        length = max((track.end for track in tracks), default=0)
+    if channels is None:
+        channels = max((track.samples.shape[0] for track in tracks), default=1)
+    out = np.zeros((channels, length), dtype=np.float32)
+    return mix_into(out, 0, tracks)
+
+
+class MixPlan:
+    """Placed tracks plus output shape, master gain and effects: a mix ready to render.
+
+    Nothing is summed until render() or blocks() is called, so a plan can be
+    rendered in full or streamed block by block with identical output.
+    `effects` is an effects.EffectsChain (or None) run on the master bus.
+    """
+
+    def __init__(self, tracks, length: int = None, channels: int = None, gain: float = 1.0, effects=None):
+        self.tracks = tracks
+        self.length = max((track.end for track in tracks), default=0) if length is None else int(length)
+        self.channels = channels or max((track.samples.shape[0] for track in tracks), default=1)
+        self.gain = gain
+        self.effects = effects
+
+    def _mix(self, start: int, n: int) -> np.ndarray:
+        """Writable (channels, n) sum of the sources over output samples [start, start + n)"""
+        out = np.zeros((self.channels, n), dtype=np.float32)
+        return mix_into(out, start, self.tracks)
+
+    def _start(self, total: int):
+        """Reset render state before producing `total` samples (the length plus effect latency)"""
+        if self.effects:
+            self.effects.reset()
+
+    def _render_block(self, start: int, n: int, gain: float) -> np.ndarray:
+        out = self._mix(start, n)
+        if gain != 1.0:
+            out *= np.float32(gain)
+        if self.effects:
+            out = self.effects.process(out)
+        np.clip(out, -1.0, 1.0, out=out)
+        return out
+
+    def blocks(self, block_size: int):
+        """Yield the mix as consecutive (channels, n) blocks of at most block_size samples.
+
+        With look-ahead effects the first block is shorter: the chain's
+        latency is rendered past the end and dropped from the start.
+        """
+        latency = self.effects.latency if self.effects else 0
+        total = self.length + latency
+        self._start(total)
+        for start in range(0, total, block_size):
+            block = self._render_block(start, min(block_size, total - start), self.gain)
+            if start < latency:
+                block = block[:, latency - start:]
+                if not block.shape[-1]:
+                    continue
+            yield block
+
+    def render(self) -> np.ndarray:
+        latency = self.effects.latency if self.effects else 0
+        self._start(self.length + latency)
+        return self._render_block(0, self.length + latency, self.gain)[:, latency:]
+
+
+def place_with_crossfade(track1: np.ndarray, track2: np.ndarray, sr: int,
+                         track1_delay: float = 0, track2_delay: float = 0,
+                         crossfade_duration: float = 3, crossfade_style: str = "linear"):
+    """Position two tracks by their delays and crossfade inside their overlap.
+
+    Mirrors the offset/crossfade endpoint: the crossfade is centred in the
+    overlap, track1 is faded out and track2 faded in across it, and both
+    tracks otherwise play at full level. Returns (tracks, length, region)
+    where region is (start, end) in samples or None.
+    """
+    t1 = PlacedTrack(track1, offset=int(track1_delay * sr))
+    t2 = PlacedTrack(track2, offset=int(track2_delay * sr))
+    length = max(t1.end, t2.end)
+
+    region = None
+    overlap_start, overlap_end = max(t1.offset, t2.offset), min(t1.end, t2.end)
+    crossfade = int(crossfade_duration * sr)
+    if crossfade > 0 and overlap_end > overlap_start:
+        overlap = overlap_end - overlap_start
+        actual = min(crossfade, overlap)
+        xf_start = overlap_start + (overlap - actual) // 2
+        fade_out, fade_in = crossfade_curves(crossfade_style, actual)
+        t1.add_ramp(xf_start, fade_out)
+        t2.add_ramp(xf_start, fade_in)
+        region = (xf_start, xf_start + actual)
+    return [t1, t2], length, region
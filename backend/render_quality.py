@@ -0,0 +1,35 @@
+import os
+
+MP3_BITRATE = int(os.getenv("MP3_BITRATE", "192"))  # kbps
+PREVIEW_SAMPLE_RATE = int(os.getenv("PREVIEW_SAMPLE_RATE", "22050"))
+PREVIEW_MP3_BITRATE = int(os.getenv("PREVIEW_MP3_BITRATE", "64"))
+PREVIEW_STRETCH_BACKEND = os.getenv("PREVIEW_STRETCH_BACKEND", "phase_vocoder")
+# Loudness gain staging: mixes are gained toward the target from stored stem loudness, then limited
+MIX_TARGET_LUFS = float(os.getenv("MIX_TARGET_LUFS", "-14"))
+MIX_MAX_GAIN_DB = float(os.getenv("MIX_MAX_GAIN_DB", "12"))
+LIMITER_CEILING_DB = float(os.getenv("LIMITER_CEILING_DB", "-1"))
+
+
+class RenderQuality:
+    """How a mix is rendered, independent of what is in it.
+
+    Every quality takes exactly the same mix parameters, so a final export
+    of a mix sounds like the preview the user edited, only cleaner.
+    """
+
+    def __init__(self, name, sample_rate, mp3_bitrate, stretch_backend=None, normalize=True):
+        self.name = name
+        self.sample_rate = sample_rate
+        self.mp3_bitrate = mp3_bitrate
+        self.stretch_backend = stretch_backend  # None: RIDDIM_STRETCH_BACKEND
+        self.normalize = normalize  # loudness gain staging + limiter
+
+
+RENDER_QUALITIES = {
+    # Full-rate, rubberband-quality stretching
+    "final": RenderQuality("final", 44100, MP3_BITRATE),
+    # For scrubbing parameters in the editor: half rate, in-process stretching.
+    # Gain staging needs no pass over the mix, so previews are leveled like final exports.
+    "preview": RenderQuality("preview", PREVIEW_SAMPLE_RATE, PREVIEW_MP3_BITRATE,
+                             stretch_backend=PREVIEW_STRETCH_BACKEND),
+}
@@ -0,0 +1,81 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+
+SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", "2048"))
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "300"))  # seconds
+
+
+class SearchCache:
+    """LRU + TTL cache for search results with single-flight coalescing.
+
+    Concurrent misses for the same key share one upstream call: the first
+    caller fetches, the rest await its result (or its exception).
+    Only successful results are cached. All bookkeeping happens on the
+    event loop between awaits, so no lock is needed.
+    """
+
+    def __init__(self, fetch, max_entries=2048, ttl=300.0):
+        self._fetch = fetch
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(query, page, genre):
+        # Spotify search is case-insensitive, so "Burna Boy" and "burna  boy" share an entry
+        return (" ".join(query.split()).casefold(), page, (genre or "").casefold())
+
+    async def get(self, query, page=1, genre=None, sort=None):
+        key = self.make_key(query, page, genre)
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            del self._entries[key]
+        self.misses += 1
+
+        flight = self._in_flight.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            # shield() so one cancelled waiter doesn't cancel the shared upstream call
+            return await asyncio.shield(flight)
+
+        flight = self._in_flight[key] = asyncio.ensure_future(self._fetch(query, page, genre, sort))
+        try:
+            result = await asyncio.shield(flight)
+        finally:
+            if flight.done():
+                self._in_flight.pop(key, None)
+            else:
+                # Leader was cancelled; drop the flight once the upstream call settles
+                flight.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return result
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,63 @@
+"""Local stand-in for the Spotify token and search endpoints.
+
+Run it, then point the API at it instead of Spotify:
+
+  uvicorn spotify_stub:app --port 9100
+  SPOTIFY_ACCOUNTS_URL=http://127.0.0.1:9100 SPOTIFY_API_URL=http://127.0.0.1:9100 uvicorn main:app
+
+STUB_LATENCY_MS adds an artificial upstream delay so concurrency behaviour of
+the async /search endpoint can be load-tested (e.g. thousands of in-flight
+searches against one uvicorn worker). /stats reports how many calls were made.
+"""
+import os
+import asyncio
+import itertools
+from fastapi import FastAPI, Form, Header
+from fastapi.responses import JSONResponse
+
+STUB_LATENCY_MS = float(os.getenv("STUB_LATENCY_MS", "50"))
+STUB_TOKEN_EXPIRES_IN = int(os.getenv("STUB_TOKEN_EXPIRES_IN", "3600"))
+
+app = FastAPI()
+
+_token_counter = itertools.count(1)
+_valid_tokens = set()
+stats = {"token_requests": 0, "search_requests": 0}
+
+@app.post("/api/token")
+async def token(grant_type: str = Form(...), client_id: str = Form(None), client_secret: str = Form(None)):
+    stats["token_requests"] += 1
+    if grant_type != "client_credentials":
+        return JSONResponse({"error": "unsupported_grant_type"}, status_code=400)
+    access_token = f"stub-token-{next(_token_counter)}"
+    _valid_tokens.add(access_token)
+    return {"access_token": access_token, "token_type": "Bearer", "expires_in": STUB_TOKEN_EXPIRES_IN}
+
+@app.get("/v1/search")
+async def search(q: str, type: str = "track", limit: int = 20, offset: int = 0,
+                 authorization: str = Header(None)):
+    stats["search_requests"] += 1
+    if not authorization or authorization.removeprefix("Bearer ") not in _valid_tokens:
+        return JSONResponse({"error": {"status": 401, "message": "Invalid access token"}}, status_code=401)
+    await asyncio.sleep(STUB_LATENCY_MS / 1000)
+    items = []
+    for i in range(offset, offset + limit):
+        items.append({
+            "id": f"stub{i:06d}",
+            "name": f"{q} #{i}",
+            "artists": [{"name": "Stub Artist"}],
+            "album": {"name": "Stub Album", "images": [{"url": "https://example.com/art.jpg"}]},
+            "duration_ms": 180000,
+            "preview_url": None,
+        })
+    return {"tracks": {"items": items, "total": 1000}}
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+@app.post("/revoke")
+def revoke_tokens():
+    """Invalidate every issued token to exercise the client's 401 retry path"""
+    _valid_tokens.clear()
+    return {"revoked": True}
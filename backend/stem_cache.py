@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import fcntl
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import unquote, urlsplit
+from downloader import stem_downloader
+
+STEM_CACHE_DIR = os.getenv("STEM_CACHE_DIR", "stem_cache")
+STEM_CACHE_MAX_BYTES = int(os.getenv("STEM_CACHE_MAX_BYTES", str(5 * 1024 ** 3)))  # 5 GB
+STEM_CACHE_REVALIDATE_AFTER = float(os.getenv("STEM_CACHE_REVALIDATE_AFTER", "86400"))  # seconds
+# Files used more recently than this are never evicted, so a render can't lose a stem mid-request
+CACHE_EVICTION_GRACE = float(os.getenv("CACHE_EVICTION_GRACE", "300"))
+# Where the catalog's stems live; the only URLs clients may mix
+STEMS_BUCKET_URL = os.getenv("STEMS_BUCKET_URL", "https://storage.googleapis.com/riddim-stems-timi-1752717149/")
+
+
+def _hash(*parts):
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class LocalFileCache:
+    """Size-bounded directory of cache files with LRU eviction.
+
+    Files are filled atomically (written to a hidden temp file in the same
+    directory, then os.replace'd into place) and per-key flock()s serialize
+    fills across threads and worker processes. Recency is tracked with the file mtime, which
+    is bumped on every hit, so all processes sharing the directory agree on the
+    LRU order.
+    """
+
+    def __init__(self, cache_dir, max_bytes, eviction_grace=CACHE_EVICTION_GRACE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.eviction_grace = eviction_grace
+        self._lock_dir = os.path.join(cache_dir, ".locks")
+        os.makedirs(self._lock_dir, exist_ok=True)
+        self._stats_lock = threading.Lock()
+        self.evictions = 0
+        self.current_bytes = self._scan()[1]
+
+    def path_for(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    @contextmanager
+    def lock(self, key):
+        """Exclusive cross-process lock for one cache key"""
+        with open(os.path.join(self._lock_dir, f"{key}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def touch(self, path):
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def write_json(self, name, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".fill-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path_for(name))
+
+    def read_json(self, name):
+        try:
+            with open(self.path_for(name)) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _is_data_file(self, name):
+        return not name.startswith(".") and not name.endswith(".json")
+
+    def _scan(self):
+        entries, total = [], 0
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if entry.is_file() and self._is_data_file(entry.name):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+        return entries, total
+
+    def evict(self):
+        """Remove least recently used files until the cache fits its byte budget"""
+        if self.current_bytes <= self.max_bytes:
+            return
+        with self.lock("evict"):
+            entries, total = self._scan()
+            now = time.time()
+            for mtime, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if now - mtime < self.eviction_grace:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                total -= size
+                with self._stats_lock:
+                    self.evictions += 1
+            with self._stats_lock:
+                self.current_bytes = total
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "cache_dir": self.cache_dir,
+                "max_bytes": self.max_bytes,
+                "current_bytes": self.current_bytes,
+                "evictions": self.evictions,
+            }
+
+
+class StemCache(LocalFileCache):
+    """Content-addressed local cache for stem files on GCS.
+
+    Each URL has a small JSON record pointing at a blob named after the URL
+    plus its ETag (or, when the server sends no ETag, a hash of the content).
+    Fresh records are served straight from disk; stale ones are revalidated
+    with If-None-Match, so an unchanged stem costs one 304 and a re-processed
+    stem gets a new blob. Blobs are read-only to callers and must not be deleted.
+    """
+
+    def __init__(self, cache_dir=STEM_CACHE_DIR, max_bytes=STEM_CACHE_MAX_BYTES,
+                 revalidate_after=STEM_CACHE_REVALIDATE_AFTER, downloader=stem_downloader):
+        super().__init__(cache_dir, max_bytes)
+        self.revalidate_after = revalidate_after
+        self.downloader = downloader
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self.bytes_saved = 0
+        self.bytes_downloaded = 0
+
+    def _lookup(self, url_key, fresh_only):
+        record = self.read_json(f"{url_key}.json")
+        if not record:
+            return None, None
+        path = self.path_for(record["blob"])
+        if not os.path.exists(path):
+            return None, None
+        if fresh_only and time.time() - record["validated_at"] > self.revalidate_after:
+            return None, record
+        return path, record
+
+    def _hit(self, path):
+        self.touch(path)
+        with self._stats_lock:
+            self.hits += 1
+            self.bytes_saved += os.path.getsize(path)
+        return path
+
+    def fetch(self, url):
+        """Return a local path holding the content of `url`, downloading on miss"""
+        url_key = _hash(url)
+        path, _ = self._lookup(url_key, fresh_only=True)
+        if path:
+            return self._hit(path)
+
+        with self.lock(url_key):
+            # Another thread or worker may have filled it while we waited
+            path, stale = self._lookup(url_key, fresh_only=True)
+            if path:
+                return self._hit(path)
+
+            suffix = os.path.splitext(url.split("?")[0])[1] or ".mp3"
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".fill-")
+            os.close(fd)
+            try:
+                headers = self.downloader.fetch_to_file(url, tmp_path, etag=stale["etag"] if stale else None)
+                if headers is None:
+                    # 304: the cached blob is still current
+                    stale["validated_at"] = time.time()
+                    self.write_json(f"{url_key}.json", stale)
+                    self._record_blob(stale["blob"], url)
+                    with self._stats_lock:
+                        self.revalidated += 1
+                    return self._hit(self.path_for(stale["blob"]))
+
+                etag = headers.get("ETag")
+                blob = (_hash(url, etag) if etag else _file_hash(tmp_path)) + suffix
+                size = os.path.getsize(tmp_path)
+                os.replace(tmp_path, self.path_for(blob))
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            self.write_json(f"{url_key}.json", {
+                "url": url, "etag": etag, "blob": blob, "validated_at": time.time(),
+            })
+            self._record_blob(blob, url)
+            with self._stats_lock:
+                self.misses += 1
+                self.bytes_downloaded += size
+                self.current_bytes += size
+        self.evict()
+        return self.path_for(blob)
+
+    def _record_blob(self, blob, url):
+        if self.blob_url(self.path_for(blob)) != url:
+            self.write_json(f"{blob}.json", {"url": url})
+
+    def blob_url(self, path):
+        """URL a blob of this cache was fetched from, or None"""
+        record = self.read_json(f"{os.path.basename(path)}.json")
+        return record and record.get("url")
+
+    def fetch_all(self, urls):
+        """Fetch many URLs concurrently; returns local paths in the same order"""
+        return self.downloader.map(self.fetch, urls)
+
+    def stats(self):
+        stats = super().stats()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            stats.update({
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidated": self.revalidated,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "bytes_downloaded": self.bytes_downloaded,
+            })
+        return stats
+
+
+stem_cache = StemCache()
+
+
+def is_stem_url(url):
+    """True for an https URL inside the stems bucket (never a server-local path)"""
+    return (isinstance(url, str) and url.startswith("https://") and url.startswith(STEMS_BUCKET_URL)
+            and ".." not in unquote(urlsplit(url).path).split("/"))
+
+
+def check_stem_urls(urls):
+    """Raise ValueError unless every one of `urls` is a stem URL (see is_stem_url)"""
+    for url in urls:
+        if not is_stem_url(url):
+            raise ValueError(f"Not a stem URL: {url!r}")
+
+
+def fetch_stem_paths(urls):
+    """Local paths for stem URLs, fetched concurrently through the stem cache"""
+    check_stem_urls(urls)
+    return stem_cache.fetch_all(urls)
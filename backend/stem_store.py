@@ -0,0 +1,212 @@
+"""Decoded stems as raw float32 files, memory-mapped for zero-decode slicing.
+
+Each stem is decoded once, at a fixed sample rate, into
+
+    64-byte header: magic, sample rate, channels, frames (little-endian)
+    frames x channels interleaved little-endian float32 samples
+
+Renders np.memmap the file and slice a time window as a read-only view:
+no decode and no resample, and a window is one contiguous byte range,
+so only its pages are read (and then shared through the page cache by
+every process on the host). Renders at another rate (previews) resample
+just their window from the same file. Files are LRU-evicted under a disk
+quota; a file evicted while mapped stays readable until it is unmapped.
+
+Stems missing from the store are never decoded on the request path: the
+processor decodes just the window it needs and queues the stem for a
+background decode (warm_later). Warm the store from the catalog ahead of
+time with `python stem_store.py --warm`.
+"""
+import os
+import struct
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import librosa
+from stem_cache import LocalFileCache, stem_cache, is_stem_url, _hash
+
+STEM_STORE_ENABLED = os.getenv("STEM_STORE_ENABLED", "1") == "1"
+STEM_STORE_DIR = os.getenv("STEM_STORE_DIR", "stem_store")
+STEM_STORE_MAX_BYTES = int(os.getenv("STEM_STORE_MAX_BYTES", str(20 * 1024 ** 3)))  # 20 GB
+STEM_STORE_SAMPLE_RATE = int(os.getenv("STEM_STORE_SAMPLE_RATE", "44100"))
+STEM_STORE_WARM_WORKERS = int(os.getenv("STEM_STORE_WARM_WORKERS", "4"))
+# Threads decoding stems first seen by a render, alongside request handling
+STEM_STORE_BACKGROUND_WORKERS = int(os.getenv("STEM_STORE_BACKGROUND_WORKERS", "1"))
+# Stored audio resampled past each end of a window at another rate and discarded
+RESAMPLE_MARGIN_SECONDS = 0.05
+
+MAGIC = b"RIDSTEM1"
+HEADER = struct.Struct("<8sIIQ")  # magic, sample rate, channels, frames
+HEADER_SIZE = 64  # keeps the samples 64-byte aligned
+
+
+class StemStore(LocalFileCache):
+    """Catalog stems decoded to memory-mappable float32 files.
+
+    Only catalog stems are stored: stems-bucket URLs and the stem cache
+    blobs fetched from them, whose names identify their content, so a
+    re-processed stem gets a new file. Every file is at `sample_rate`.
+    """
+
+    def __init__(self, cache_dir=STEM_STORE_DIR, max_bytes=STEM_STORE_MAX_BYTES, source_cache=stem_cache,
+                 sample_rate=STEM_STORE_SAMPLE_RATE):
+        super().__init__(cache_dir, max_bytes)
+        self.source_cache = source_cache
+        self.sample_rate = sample_rate
+        self.hits = 0
+        self.misses = 0
+        self._warming = set()
+        self._warm_executor = None
+        self._warm_lock = threading.Lock()
+
+    def accepts(self, source):
+        if source.startswith("http"):
+            return is_stem_url(source)
+        if os.path.dirname(os.path.abspath(source)) != os.path.abspath(self.source_cache.cache_dir):
+            return False
+        return is_stem_url(self.source_cache.blob_url(source))
+
+    def _local_source(self, source):
+        return self.source_cache.fetch(source) if source.startswith("http") else source
+
+    def _path(self, blob):
+        return self.path_for(f"{_hash(blob)}.f32")
+
+    def _decode(self, blob_path, path):
+        y, _ = librosa.load(blob_path, sr=self.sample_rate, mono=False)
+        y = np.atleast_2d(y)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, prefix=".fill-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(HEADER.pack(MAGIC, self.sample_rate, y.shape[0], y.shape[1]).ljust(HEADER_SIZE, b"\0"))
+                np.ascontiguousarray(y.T, dtype="<f4").tofile(f)
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        with self._stats_lock:
+            self.misses += 1
+            self.current_bytes += size
+        self.evict()
+
+    def stored(self, source):
+        """Whether `source` is already in the store (never decodes)"""
+        return os.path.exists(self._path(os.path.basename(self._local_source(source))))
+
+    def warm_later(self, source):
+        """Decode `source` into the store on a background thread, once however often it is asked for"""
+        with self._warm_lock:
+            if source in self._warming:
+                return
+            self._warming.add(source)
+            if self._warm_executor is None:
+                self._warm_executor = ThreadPoolExecutor(max_workers=STEM_STORE_BACKGROUND_WORKERS,
+                                                         thread_name_prefix="stem-store-bg")
+        self._warm_executor.submit(self._warm_one, source)
+
+    def _warm_one(self, source):
+        try:
+            self.ensure(source)
+        except Exception as e:
+            print(f"[StemStore] Could not store {source}: {e}")
+        finally:
+            with self._warm_lock:
+                self._warming.discard(source)
+
+    def ensure(self, source):
+        """Path of the stored file for `source`, decoding it on a miss"""
+        blob_path = self._local_source(source)
+        path = self._path(os.path.basename(blob_path))
+        if self.touch(path):
+            with self._stats_lock:
+                self.hits += 1
+            return path
+        with self.lock(os.path.basename(path)):
+            # Another thread or worker may have decoded it while we waited
+            if not self.touch(path):
+                self._decode(blob_path, path)
+        return path
+
+    def load(self, source):
+        """Read-only (channels, frames) view of a whole stem at the store's sample rate"""
+        path = self.ensure(source)
+        with open(path, "rb") as f:
+            magic, stored_rate, channels, frames = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or stored_rate != self.sample_rate:
+            raise ValueError(f"Not a {self.sample_rate} Hz stem store file: {path}")
+        if frames == 0:
+            return np.zeros((channels, 0), dtype=np.float32)
+        return np.memmap(path, dtype="<f4", mode="r", offset=HEADER_SIZE, shape=(frames, channels)).T
+
+    def window(self, source, start=0.0, end=None, mono=True, sample_rate=None):
+        """[start, end) seconds of a stem as (y, sr) at `sample_rate` (default: the store's).
+
+        At the store's rate this is a zero-copy view unless a stereo stem is
+        downmixed; other rates resample only the window (plus a short margin).
+        """
+        sample_rate = sample_rate or self.sample_rate
+        y = self.load(source)
+        first = int(round(start * self.sample_rate))
+        last = None if end is None else first + int(round((end - start) * self.sample_rate))
+        margin = 0 if sample_rate == self.sample_rate else int(RESAMPLE_MARGIN_SECONDS * self.sample_rate)
+        lo = max(0, first - margin)
+        y = y[:, lo:None if last is None else last + margin]
+        # Shaped like librosa.load: mono stems (or mono=True) come back 1-D
+        if y.shape[0] == 1:
+            y = y[0]
+        elif mono:
+            y = y.mean(axis=0)
+        if sample_rate != self.sample_rate:
+            y = librosa.resample(np.ascontiguousarray(y), orig_sr=self.sample_rate, target_sr=sample_rate)
+            skip = int(round((first - lo) * sample_rate / self.sample_rate))
+            y = y[..., skip:None if end is None else skip + int(round((end - start) * sample_rate))]
+        return y, sample_rate
+
+    def warm(self, sources, max_workers=STEM_STORE_WARM_WORKERS):
+        """Decode many stems into the store; returns the sources that failed"""
+        def ensure(source):
+            try:
+                self.ensure(source)
+            except Exception as e:
+                print(f"[StemStore] Could not store {source}: {e}")
+                return source
+
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stem-store") as executor:
+            return [source for source in executor.map(ensure, sources) if source]
+
+    def stats(self):
+        stats = super().stats()
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            stats.update({
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            })
+        return stats
+
+
+stem_store = StemStore() if STEM_STORE_ENABLED else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--warm", action="store_true", help="decode the catalog's stems into the store")
+    parser.add_argument("--limit", type=int, default=None, help="only the N highest-ranked tracks")
+    args = parser.parse_args()
+
+    store = stem_store or StemStore()
+    if args.warm:
+        from db import get_catalog_stem_urls
+        urls = get_catalog_stem_urls(args.limit)
+        print(f"[StemStore] Warming {len(urls)} stems at {store.sample_rate} Hz")
+        failed = store.warm(urls)
+        print(f"[StemStore] Done, {len(failed)} failed")
+    print(store.stats())
+
+
+if __name__ == "__main__":
+    main()
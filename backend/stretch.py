@@ -0,0 +1,166 @@
+"""Time-stretch / pitch-shift backends for float32 sample buffers.
+
+Buffers are librosa-style: (n_samples,) or (channels, n_samples). A
+tempo_factor above 1 speeds audio up (output is len / tempo_factor samples),
+matching pyrubberband and librosa.
+
+  rubberband     pyrubberband: writes a temp WAV and runs the rubberband CLI
+                 (highest quality, fixed per-call process/disk overhead)
+  phase_vocoder  in-process NumPy phase vocoder; pitch shift is a stretch
+                 followed by one resample, so tempo + pitch is a single pass
+
+RIDDIM_STRETCH_BACKEND picks the default; bench_stretch.py compares them.
+"""
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import resample
+
+try:
+    import pyrubberband as pyrb
+except ImportError:
+    pyrb = None
+
+STRETCH_BACKEND = os.getenv("RIDDIM_STRETCH_BACKEND", "rubberband")
+
+
+class StretchBackend:
+    """Apply tempo and pitch changes to a buffer in one call"""
+
+    name = "base"
+
+    def process(self, y: np.ndarray, sr: int, tempo_factor: float = 1.0,
+                pitch_semitones: float = 0.0) -> np.ndarray:
+        if tempo_factor == 1.0 and pitch_semitones == 0.0:
+            return y
+        return self._process(y, sr, tempo_factor, pitch_semitones)
+
+    def _process(self, y, sr, tempo_factor, pitch_semitones):
+        raise NotImplementedError
+
+
+class RubberbandCLIBackend(StretchBackend):
+    name = "rubberband"
+
+    def __init__(self):
+        if pyrb is None:
+            raise ImportError("pyrubberband is not installed (set RIDDIM_STRETCH_BACKEND=phase_vocoder)")
+
+    def _process(self, y, sr, tempo_factor, pitch_semitones):
+        # pyrubberband wants (n_samples, channels)
+        data = y.T if y.ndim == 2 else y
+        if tempo_factor == 1.0:
+            out = pyrb.pitch_shift(data, sr, pitch_semitones)
+        else:
+            rbargs = {"--pitch": pitch_semitones} if pitch_semitones != 0.0 else None
+            out = pyrb.time_stretch(data, sr, tempo_factor, rbargs=rbargs)
+        out = out.astype(np.float32, copy=False)
+        return out.T if y.ndim == 2 else out
+
+
+class PhaseVocoderBackend(StretchBackend):
+    """Vectorized STFT phase vocoder; no temp files or subprocesses.
+
+    Magnitudes are interpolated between analysis frames and phases are
+    advanced with one cumulative sum over all output frames, so the whole
+    buffer (every channel at once) is processed without a Python loop over
+    frames. Transients are softer than rubberband's, which is the trade-off
+    for avoiding the CLI round trip on short snippets.
+    """
+
+    name = "phase_vocoder"
+
+    def __init__(self, n_fft: int = 2048, hop_length: int = 512):
+        if n_fft % hop_length:
+            raise ValueError("n_fft must be a multiple of hop_length")
+        self.n_fft = n_fft
+        self.hop = hop_length
+        self.window = np.hanning(n_fft + 1)[:-1].astype(np.float32)
+
+    def _stft(self, y):
+        pad = [(0, 0)] * (y.ndim - 1) + [(self.n_fft // 2, self.n_fft // 2)]
+        frames = sliding_window_view(np.pad(y, pad, mode="reflect"), self.n_fft, axis=-1)[..., ::self.hop, :]
+        return np.fft.rfft(frames * self.window, axis=-1)  # (..., n_frames, n_bins)
+
+    def _istft(self, spec, length):
+        frames = np.fft.irfft(spec, n=self.n_fft, axis=-1).astype(np.float32) * self.window
+        n_frames, overlap = frames.shape[-2], self.n_fft // self.hop
+        # Overlap-add as `overlap` shifted sums of hop-sized segments
+        out = np.zeros(frames.shape[:-2] + (n_frames + overlap - 1, self.hop), dtype=np.float32)
+        norm = np.zeros((n_frames + overlap - 1, self.hop), dtype=np.float32)
+        window_sq = (self.window ** 2).reshape(overlap, self.hop)
+        for k in range(overlap):
+            out[..., k:k + n_frames, :] += frames[..., k * self.hop:(k + 1) * self.hop]
+            norm[k:k + n_frames] += window_sq[k]
+        out /= np.maximum(norm, 1e-3)
+        out = out.reshape(frames.shape[:-2] + (-1,))
+        out = out[..., self.n_fft // 2:self.n_fft // 2 + length]
+        if out.shape[-1] < length:
+            out = np.pad(out, [(0, 0)] * (out.ndim - 1) + [(0, length - out.shape[-1])])
+        return out
+
+    def time_stretch(self, y: np.ndarray, rate: float, length: int = None) -> np.ndarray:
+        length = length or int(round(y.shape[-1] / rate))
+        spec = self._stft(y)
+        n_frames = spec.shape[-2]
+        steps = np.arange(0, n_frames, rate)
+        idx = steps.astype(np.int64)
+        alpha = (steps - idx).astype(np.float32)[:, np.newaxis]
+
+        # Two frames of zero padding so idx + 1 is always valid
+        spec = np.concatenate([spec, np.zeros_like(spec[..., :2, :])], axis=-2)
+        mag = np.abs(spec)
+        phase = np.angle(spec)
+        expected = np.linspace(0, np.pi * self.hop, spec.shape[-1])
+        dphase = np.diff(phase, axis=-2) - expected
+        dphase -= 2 * np.pi * np.round(dphase / (2 * np.pi))
+
+        out_mag = (1 - alpha) * mag[..., idx, :] + alpha * mag[..., idx + 1, :]
+        advance = expected + dphase[..., idx, :]
+        out_phase = np.cumsum(advance, axis=-2) - advance + phase[..., :1, :]
+        return self._istft(out_mag * np.exp(1j * self._lock_phases(out_mag, out_phase, phase[..., idx, :])), length)
+
+    @staticmethod
+    def _lock_phases(mag, phase, analysis_phase):
+        """Identity phase locking: each bin follows its nearest spectral peak.
+
+        Only peak bins keep their propagated phase; the others take the peak's
+        phase plus their offset from it in the analysis frame, which keeps the
+        bins of one partial coherent instead of drifting apart ("phasiness").
+        """
+        n_bins = mag.shape[-1]
+        bins = np.arange(n_bins)
+        peak = np.zeros(mag.shape, dtype=bool)
+        peak[..., 1:-1] = (mag[..., 1:-1] > mag[..., :-2]) & (mag[..., 1:-1] >= mag[..., 2:])
+        prev = np.maximum.accumulate(np.where(peak, bins, -1), axis=-1)
+        nxt = np.minimum.accumulate(np.where(peak, bins, n_bins)[..., ::-1], axis=-1)[..., ::-1]
+        use_prev = (prev >= 0) & ((nxt >= n_bins) | (bins - prev <= nxt - bins))
+        nearest = np.where(use_prev, prev, nxt)
+        nearest = np.where(nearest >= n_bins, bins, nearest)
+        return (np.take_along_axis(phase, nearest, axis=-1)
+                + analysis_phase - np.take_along_axis(analysis_phase, nearest, axis=-1))
+
+    def _process(self, y, sr, tempo_factor, pitch_semitones):
+        y = np.asarray(y, dtype=np.float32)
+        length = int(round(y.shape[-1] / tempo_factor))
+        if pitch_semitones == 0.0:
+            return self.time_stretch(y, tempo_factor, length)
+        # Stretch to length * ratio, then resample back down: pitch rises by ratio
+        ratio = 2.0 ** (pitch_semitones / 12.0)
+        stretched_length = int(round(length * ratio))
+        stretched = self.time_stretch(y, y.shape[-1] / stretched_length, stretched_length)
+        return resample(stretched, length, axis=-1).astype(np.float32)
+
+
+STRETCH_BACKENDS = {
+    RubberbandCLIBackend.name: RubberbandCLIBackend,
+    PhaseVocoderBackend.name: PhaseVocoderBackend,
+}
+
+
+def get_stretch_backend(name: str = None) -> StretchBackend:
+    """Instantiate a backend by name (defaults to RIDDIM_STRETCH_BACKEND)"""
+    name = name or STRETCH_BACKEND
+    if name not in STRETCH_BACKENDS:
+        raise ValueError(f"Unknown stretch backend '{name}'. Choose from {sorted(STRETCH_BACKENDS)}")
+    return STRETCH_BACKENDS[name]()
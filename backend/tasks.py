@@ -1,9 +1,49 @@
-from celery_worker import celery_app
-import yt_dlp
+from celery_worker import celery_app, release_render_job
+from stem_cache import fetch_stem_paths
+from mix_cache import mix_cache, mix_cache_key
+from render_quality import RENDER_QUALITIES
+from track_analysis import get_request_loudness
+from mix_graph import spec_urls
+import math
 import os
 
+# Worker-side processors, one per render quality sharing decoded audio, built on first use
+# so the API process can import this module without the audio stack
+_render_processors = {}
+
+
+def get_render_processor(quality):
+    if not _render_processors:
+        from audio_processor import RiddimAudioProcessor
+        from audio_cache import AudioBufferCache
+        from stem_store import stem_store
+        buffer_cache = AudioBufferCache()
+        _render_processors.update({
+            name: RiddimAudioProcessor.for_quality(render_quality, buffer_cache, stem_store)
+            for name, render_quality in RENDER_QUALITIES.items()
+        })
+    return _render_processors[quality]
+
+
+def plan_mix(processor, kind, track1_urls, track2_urls, track1_paths, track2_paths, params, stem_loudness):
+    """MixPlan for a "stems" (create_mix_from_urls), "crossfade" (create_mix_with_offset_and_crossfade)
+    or "graph" (create_mix_graph, all sources as track1) request, gain-staged from get_request_loudness"""
+    if kind == "stems":
+        return processor.plan_mix_from_stems(track1_paths, track2_paths, params, stem_loudness)
+    if kind == "crossfade":
+        return processor.plan_mix_with_offset_and_crossfade(
+            track1_paths, track2_paths,
+            params["track1_delay"], params["track2_delay"],
+            params["crossfade_duration"], params["crossfade_style"],
+            stem_loudness,
+        )
+    if kind == "graph":
+        return processor.plan_mix_graph(params, dict(zip(track1_urls, track1_paths)), stem_loudness)
+    raise ValueError(f"Unknown mix kind: {kind}")
+
 @celery_app.task(bind=True)
 def download_track_task(self, url, out_name):
+    import yt_dlp
     output_dir = "storage"
     os.makedirs(output_dir, exist_ok=True)
     ydl_opts = {
@@ -27,4 +67,59 @@ def process_track_task(self, filename):
     os.makedirs(output_dir, exist_ok=True)
     # Removed: separator = Separator('spleeter:2stems')
     # Removed: separator.separate_to_file(input_path, output_dir)
-    return {"stems_dir": output_dir} 
\ No newline at end of file
+    return {"stems_dir": output_dir}
+
+@celery_app.task(bind=True)
+def render_mix_task(self, kind, quality, track1_urls, track2_urls, params):
+    """Render a mix into the mix cache, reporting each stage through the task state.
+
+    The rendered file is retrieved from the mix cache by the returned
+    cache_key, so the API and workers must share MIX_CACHE_DIR.
+    """
+    try:
+        return render_mix(self, kind, quality, track1_urls, track2_urls, params)
+    finally:
+        # Finished either way: the task state (PROGRESS until the result is stored) takes over from the claim
+        release_render_job(self.request.id)
+
+
+def render_mix(task, kind, quality, track1_urls, track2_urls, params):
+    def report(stage, progress):
+        task.update_state(state="PROGRESS", meta={"stage": stage, "progress": round(progress, 3)})
+
+    if kind == "graph":
+        # Same check as the API, so a malformed spec fails the job before any stem is fetched
+        spec_urls(params)
+    report("fetching_stems", 0.0)
+    stem_paths = fetch_stem_paths(track1_urls + track2_urls)
+    track1_paths, track2_paths = stem_paths[:len(track1_urls)], stem_paths[len(track1_urls):]
+    stem_loudness = get_request_loudness(kind, track1_urls, track2_urls, params)
+    cache_key = mix_cache_key(kind, track1_paths, track2_paths,
+                              dict(params, quality=quality, stem_loudness=stem_loudness))
+    if mix_cache.get(cache_key):
+        return {"cache_key": cache_key, "cached": True}
+
+    report("decoding", 0.1)
+    processor = get_render_processor(quality)
+    plan = plan_mix(processor, kind, track1_urls, track2_urls, track1_paths, track2_paths, params, stem_loudness)
+
+    from audio_encoder import MP3_STREAMING_AVAILABLE, RENDER_BLOCK_SIZE, encode_audio, encode_mp3_stream
+    if not MP3_STREAMING_AVAILABLE:
+        report("rendering", 0.3)
+        mix_cache.put_bytes(cache_key, encode_audio(plan.render(), processor.sr, bitrate=processor.mp3_bitrate))
+        return {"cache_key": cache_key, "cached": False}
+
+    # Render and encode block by block, reporting roughly every 5% of the mix
+    n_blocks = max(1, math.ceil(plan.length / RENDER_BLOCK_SIZE))
+    report_every = max(1, n_blocks // 20)
+
+    def tracked_blocks():
+        for i, block in enumerate(plan.blocks(RENDER_BLOCK_SIZE)):
+            if i % report_every == 0:
+                report("rendering", 0.3 + 0.7 * i / n_blocks)
+            yield block
+
+    encoded = encode_mp3_stream(tracked_blocks(), processor.sr, plan.channels, processor.mp3_bitrate)
+    for _ in mix_cache.tee(cache_key, encoded):
+        pass
+    return {"cache_key": cache_key, "cached": False}
@@ -0,0 +1,177 @@
+import re
+import logging
+from functools import lru_cache
+import numpy as np
+from db import get_track_analyses, save_track_analysis, PoolTimeout
+from stem_cache import stem_cache
+from loudness import window_loudness
+from harmonic import harmonic_suggestions
+from mix_graph import track_time_window
+
+logger = logging.getLogger(__name__)
+
+# GCS layout written by musicdatabase/riddim_batch_processor.py
+_STEM_URL_RE = re.compile(r"/stems/(?P<id>[^/]+)/(?P<source>[^/.]+)\.\w+$")
+_SONG_URL_RE = re.compile(r"/songs/(?P<id>[^/.]+)\.\w+$")
+
+
+def parse_audio_url(audio_url):
+    """Map a catalog GCS URL to its (spotify_track_id, source) analysis key, or None"""
+    path = audio_url.split("?")[0]
+    match = _STEM_URL_RE.search(path)
+    if match:
+        return match.group("id"), match.group("source")
+    match = _SONG_URL_RE.search(path)
+    if match:
+        return match.group("id"), "full_song"
+    return None
+
+
+def _row_to_analysis(row):
+    beat_times = row["beat_times"] or []
+    return {
+        "tempo": row["tempo"],
+        "key": row["tuning"],
+        "energy": row["rms_energy"],
+        "duration": row["duration"],
+        "beats_count": len(beat_times),
+        "beat_times": beat_times,
+        "loudness_lufs": row.get("loudness_lufs"),
+        "true_peak_dbtp": row.get("true_peak_dbtp"),
+    }
+
+
+def get_analyses(audio_urls, processor):
+    """Return analyses for `audio_urls` (in order) from the track_analysis table.
+
+    Hits cost one indexed lookup for the whole batch. Misses are analyzed with
+    `processor` (stems fetched through the local stem cache) and written back,
+    so each catalog file is decoded and analyzed at most once. URLs outside
+    the catalog layout are analyzed every time.
+    """
+    keys = [parse_audio_url(url) for url in audio_urls]
+    stored = get_track_analyses([key for key in keys if key])
+
+    analyses = [None] * len(audio_urls)
+    misses = []
+    for i, key in enumerate(keys):
+        row = stored.get(key) if key else None
+        if row is not None:
+            analyses[i] = _row_to_analysis(row)
+        else:
+            misses.append(i)
+
+    if misses:
+        if processor is None:
+            raise RuntimeError("Audio analysis not precomputed and audio processing is disabled")
+        paths = stem_cache.fetch_all([audio_urls[i] for i in misses])
+        for i, path in zip(misses, paths):
+            analysis = processor.analyze_audio(path)
+            analyses[i] = analysis
+            if keys[i]:
+                try:
+                    save_track_analysis(keys[i][0], keys[i][1], analysis)
+                    logger.info(f"Backfilled analysis for {keys[i]}")
+                except Exception as e:
+                    logger.error(f"Failed to store analysis for {keys[i]}: {e}")
+    return analyses
+
+
+def _sidecar_url(audio_url, spotify_track_id):
+    """URL of the analysis.npz sidecar uploaded next to a catalog track's stems"""
+    path = audio_url.split("?")[0]
+    match = _STEM_URL_RE.search(path) or _SONG_URL_RE.search(path)
+    return f"{path[:match.start()]}/stems/{spotify_track_id}/analysis.npz"
+
+
+@lru_cache(maxsize=256)
+def _load_short_term_curves(sidecar_path):
+    """{source: (short-term LUFS curve, hop seconds)} from a sidecar (blobs are content-addressed, so cacheable)"""
+    with np.load(sidecar_path) as sidecar:
+        if "short_term_hop_seconds" not in sidecar:
+            return {}
+        hop = float(sidecar["short_term_hop_seconds"])
+        return {
+            name[len("short_term_lufs_"):]: (sidecar[name].astype(np.float32), hop)
+            for name in sidecar.files if name.startswith("short_term_lufs_")
+        }
+
+
+def _window_level(audio_url, key, integrated, time_window):
+    try:
+        curves = _load_short_term_curves(stem_cache.fetch(_sidecar_url(audio_url, key[0])))
+    except Exception as e:
+        logger.info(f"No loudness curve for {key}: {e}")
+        return integrated
+    if key[1] not in curves:
+        return integrated
+    curve, hop = curves[key[1]]
+    level = window_loudness(curve, hop, float(time_window.get("start", 0)), time_window.get("end"))
+    return integrated if level is None else level
+
+
+def get_stem_loudness(audio_urls, time_windows=None):
+    """Stored loudness (LUFS) of each catalog URL, None where unknown.
+
+    Integrated loudness from track_analysis; where `time_windows` (one per
+    URL, or None) gives a window, the level of that window from the sidecar's
+    short-term curve when it has one.
+    """
+    keys = [parse_audio_url(url) for url in audio_urls]
+    time_windows = time_windows or [None] * len(audio_urls)
+    try:
+        stored = get_track_analyses([key for key in keys if key])
+    except PoolTimeout:
+        # Shed the request rather than measure every stem under load
+        raise
+    except Exception as e:
+        logger.error(f"Loudness lookup failed: {e}")
+        return [None] * len(audio_urls)
+
+    levels = []
+    for url, key, time_window in zip(audio_urls, keys, time_windows):
+        row = stored.get(key) if key else None
+        level = row.get("loudness_lufs") if row else None
+        if level is not None and time_window:
+            level = _window_level(url, key, level, time_window)
+        levels.append(level)
+    return levels
+
+
+def get_tracks_loudness(track_urls, time_windows=None):
+    """Stem levels of each track (a list of stem URLs, with an optional time window each), in one lookup"""
+    time_windows = time_windows or [None] * len(track_urls)
+    levels = get_stem_loudness(
+        [url for urls in track_urls for url in urls],
+        [window for urls, window in zip(track_urls, time_windows) for _ in urls],
+    )
+    per_track, start = [], 0
+    for urls in track_urls:
+        per_track.append(levels[start:start + len(urls)])
+        start += len(urls)
+    return per_track
+
+
+def get_mix_loudness(track1_urls, track2_urls, track1_window=None, track2_window=None):
+    """(track1 levels, track2 levels) for a two-track mix, in one lookup"""
+    return tuple(get_tracks_loudness([track1_urls, track2_urls], [track1_window, track2_window]))
+
+
+def get_request_loudness(kind, track1_urls, track2_urls, params):
+    """Stored stem levels a mix request of `kind` ("stems", "crossfade" or "graph") is gain-staged from.
+
+    They decide the mix gain, so they belong in its mix cache key: a mix
+    cached while a level was unknown (and measured instead) renders again
+    once the level is stored.
+    """
+    if kind == "stems":
+        return get_mix_loudness(track1_urls, track2_urls,
+                                params.get("track1_time_window"), params.get("track2_time_window"))
+    if kind == "crossfade":
+        return get_mix_loudness(track1_urls, track2_urls)
+    if kind == "graph":
+        tracks = params.get("tracks")
+        if not tracks:
+            return None
+        return get_tracks_loudness([track["urls"] for track in tracks], [track_time_window(track) for track in tracks])
+    raise ValueError(f"Unknown mix kind: {kind}")
@@ -12,9 +12,13 @@ USAGE:
   
   # Process specific range
   python3 riddim_batch_processor.py --manifest manifest.json --start-rank 1 --end-rank 50
+  
+  # Analyze tracks processed before the analysis (or loudness) stage existed
+  python3 riddim_batch_processor.py --backfill-analysis --workers 8
 """
 
 import os
+import sys
 import subprocess
 import logging
 import json
@@ -25,12 +29,130 @@ from psycopg2.extras import RealDictCursor
 import argparse
 from datetime import datetime
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import librosa
+import requests
 from dotenv import load_dotenv
 load_dotenv()
+# BS.1770 measurement shared with the mixer (backend/loudness.py); on GCE instances it's copied next to this script
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import loudness
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Analysis runs at librosa's default rate: plenty for beats/key/loudness, half the decode cost of 44.1 kHz
+ANALYSIS_SR = 22050
+RMS_HOP = 512  # ~23 ms envelope resolution at ANALYSIS_SR
+# Loudness is measured full-band and in stereo, as the mixer hears the stems
+LOUDNESS_SR = 44100
+STEM_NAMES = ["vocals", "drums", "bass", "other"]
+
+KEY_NAMES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+# Krumhansl-Kessler key profiles
+MAJOR_PROFILE = np.array([6.35, 2.23, 3.48, 2.33, 4.38, 4.09, 2.52, 5.19, 2.39, 3.66, 2.29, 2.88])
+MINOR_PROFILE = np.array([6.33, 2.68, 3.52, 5.38, 2.60, 3.53, 2.54, 4.75, 3.98, 2.69, 3.34, 3.17])
+
+ANALYSIS_SCHEMA = [
+    "ALTER TABLE stems ADD COLUMN IF NOT EXISTS tempo REAL",
+    "ALTER TABLE stems ADD COLUMN IF NOT EXISTS musical_key TEXT",
+    "ALTER TABLE stems ADD COLUMN IF NOT EXISTS tuning REAL",
+    "ALTER TABLE stems ADD COLUMN IF NOT EXISTS loudness_db REAL",
+    "ALTER TABLE stems ADD COLUMN IF NOT EXISTS analysis_url TEXT",
+    "ALTER TABLE stems ADD COLUMN IF NOT EXISTS loudness_lufs REAL",
+    "ALTER TABLE stems ADD COLUMN IF NOT EXISTS true_peak_dbtp REAL",
+    # Same table the API reads in backend/db.py
+    """CREATE TABLE IF NOT EXISTS track_analysis (
+        spotify_track_id TEXT NOT NULL,
+        source TEXT NOT NULL,
+        tempo REAL,
+        tuning REAL,
+        rms_energy REAL,
+        duration REAL,
+        beat_times REAL[],
+        loudness_lufs REAL,
+        true_peak_dbtp REAL,
+        analyzed_at TIMESTAMPTZ DEFAULT NOW(),
+        PRIMARY KEY (spotify_track_id, source)
+    )""",
+    "ALTER TABLE track_analysis ADD COLUMN IF NOT EXISTS loudness_lufs REAL",
+    "ALTER TABLE track_analysis ADD COLUMN IF NOT EXISTS true_peak_dbtp REAL",
+]
+
+def estimate_key(chroma_mean):
+    """Best-matching major/minor key for a 12-bin mean chroma vector, e.g. 'A minor'"""
+    best_score, best_key = -np.inf, None
+    for mode, profile in (("major", MAJOR_PROFILE), ("minor", MINOR_PROFILE)):
+        for tonic in range(12):
+            score = np.corrcoef(chroma_mean, np.roll(profile, tonic))[0, 1]
+            if score > best_score:
+                best_score, best_key = score, f"{KEY_NAMES[tonic]} {mode}"
+    return best_key
+
+def loudness_db(y):
+    """Overall RMS level in dBFS"""
+    return float(20 * np.log10(np.sqrt(np.mean(np.square(y))) + 1e-10))
+
+def load_for_analysis(path):
+    """Decode once: the full-band stereo buffer for loudness, and a mono ANALYSIS_SR copy for everything else"""
+    full_band, _ = librosa.load(path, sr=LOUDNESS_SR, mono=False)
+    analysis = librosa.resample(librosa.to_mono(full_band), orig_sr=LOUDNESS_SR, target_sr=ANALYSIS_SR)
+    return full_band, analysis
+
+def analyze_track_audio(full_song_path, stem_files, sidecar_path):
+    """Decode the song and each stem once and derive everything the API needs.
+
+    Writes a compressed npz sidecar (beat grid, per-source RMS envelopes and
+    short-term loudness curves) to `sidecar_path` and returns the summary
+    values for the database.
+    """
+    full, y = load_for_analysis(full_song_path)
+    sr = ANALYSIS_SR
+    tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
+    beat_times = librosa.frames_to_time(beats, sr=sr)
+    tuning = float(librosa.estimate_tuning(y=y, sr=sr))
+    chroma = librosa.feature.chroma_cqt(y=y, sr=sr, tuning=tuning)
+    musical_key = estimate_key(chroma.mean(axis=1))
+
+    sidecar = {
+        "beat_times": beat_times.astype(np.float32),
+        "tempo": np.float32(tempo),
+        "tuning": np.float32(tuning),
+        "sample_rate": np.int32(sr),
+        "rms_hop_seconds": np.float32(RMS_HOP / sr),
+        "short_term_hop_seconds": np.float32(loudness.SHORT_TERM_HOP_SECONDS),
+    }
+    # Stems share the song's timeline, so they share its beat grid and tempo
+    sources = {}
+    for source, loaded in [("full_song", (full, y))] + [(stem, None) for stem in STEM_NAMES if stem in stem_files]:
+        full_band, audio = loaded or load_for_analysis(stem_files[source])
+        rms = librosa.feature.rms(y=audio, hop_length=RMS_HOP)[0]
+        measured = loudness.measure(full_band, LOUDNESS_SR)
+        loudness_lufs, true_peak_dbtp = measured["loudness_lufs"], measured["true_peak_dbtp"]
+        sidecar[f"rms_{source}"] = rms.astype(np.float16)
+        sidecar[f"short_term_lufs_{source}"] = measured["short_term_lufs"].astype(np.float16)
+        sources[source] = {
+            "rms_energy": float(np.mean(rms)),
+            "duration": float(len(audio) / sr),
+            "loudness_db": loudness_db(audio),
+            "loudness_lufs": loudness_lufs,
+            "true_peak_dbtp": true_peak_dbtp,
+        }
+        sidecar[f"loudness_db_{source}"] = np.float32(sources[source]["loudness_db"])
+        sidecar[f"loudness_lufs_{source}"] = np.float32(loudness_lufs)
+        sidecar[f"true_peak_dbtp_{source}"] = np.float32(true_peak_dbtp)
+
+    np.savez_compressed(sidecar_path, **sidecar)
+    return {
+        "tempo": float(tempo),
+        "tuning": tuning,
+        "musical_key": musical_key,
+        "beat_times": beat_times.tolist(),
+        "sources": sources,
+        "sidecar_path": str(sidecar_path),
+    }
+
 class RiddimBatchProcessor:
     def __init__(self, gcs_bucket="gs://riddim-stems-timi-1752717149", db_url=None):
         self.gcs_bucket = gcs_bucket
@@ -165,7 +287,25 @@ class RiddimBatchProcessor:
             logger.error(f"❌ [{rank:03d}] Stem separation failed: {spotify_id} - {e}")
             return None, 0
     
-    def upload_to_gcs(self, track_info, full_song_path, stem_files):
+    def analyze_track(self, track_info, audio_file, stem_files):
+        """Compute beat grid, tempo, key, per-stem loudness and RMS envelopes"""
+        spotify_id = track_info['spotify_id']
+        rank = track_info['rank']
+        
+        try:
+            logger.info(f"📈 [{rank:03d}] Analyzing audio: {spotify_id}")
+            start_time = time.time()
+            sidecar_path = Path(audio_file).parent / "analysis.npz"
+            analysis = analyze_track_audio(audio_file, stem_files, sidecar_path)
+            logger.info(f"✅ [{rank:03d}] Analyzed in {time.time() - start_time:.1f}s: "
+                        f"{analysis['tempo']:.1f} BPM, {analysis['musical_key']}")
+            return analysis
+        except Exception as e:
+            # Not fatal: stems are still useful and the track can be backfilled later
+            logger.warning(f"⚠️  [{rank:03d}] Analysis failed: {spotify_id} - {e}")
+            return None
+    
+    def upload_to_gcs(self, track_info, full_song_path, stem_files, analysis_file=None):
         """Upload full song + MP3 stems to Google Cloud Storage"""
         spotify_id = track_info['spotify_id']
         rank = track_info['rank']
@@ -188,6 +328,11 @@ class RiddimBatchProcessor:
                 uploaded_urls[stem_type] = stem_gcs.replace('gs://', 'https://storage.googleapis.com/')
                 logger.info(f"☁️  [{rank:03d}] Uploaded {stem_type} stem (MP3)")
             
+            # Upload analysis sidecar next to the stems
+            if analysis_file:
+                uploaded_urls['analysis'] = self.upload_analysis(spotify_id, analysis_file)
+                logger.info(f"☁️  [{rank:03d}] Uploaded analysis sidecar")
+            
             logger.info(f"✅ [{rank:03d}] All files uploaded to GCS")
             return uploaded_urls
             
@@ -198,6 +343,13 @@ class RiddimBatchProcessor:
             logger.error(f"⏰ [{rank:03d}] GCS upload timeout: {spotify_id}")
             return None
     
+    def upload_analysis(self, spotify_id, analysis_file):
+        """Upload the npz sidecar to stems/<id>/analysis.npz and return its public URL"""
+        analysis_gcs = f"{self.gcs_bucket}/stems/{spotify_id}/analysis.npz"
+        cmd = ["gsutil", "cp", str(analysis_file), analysis_gcs]
+        subprocess.run(cmd, check=True, timeout=300)
+        return analysis_gcs.replace('gs://', 'https://storage.googleapis.com/')
+    
     def save_to_database(self, track_info, uploaded_urls, file_size_mb, processing_time):
         """Save track metadata and URLs to Railway database"""
         if not self.db_url:
@@ -254,6 +406,68 @@ class RiddimBatchProcessor:
             logger.error(f"❌ [{track_info['rank']:03d}] Database save failed: {e}")
             return False
     
+    def ensure_analysis_schema(self):
+        with psycopg2.connect(self.db_url) as conn:
+            with conn.cursor() as cur:
+                for statement in ANALYSIS_SCHEMA:
+                    cur.execute(statement)
+    
+    def save_analysis(self, spotify_id, analysis, analysis_url):
+        """Write summary columns to stems and per-source rows to track_analysis"""
+        if not self.db_url:
+            logger.error("No database URL provided")
+            return False
+        
+        try:
+            with psycopg2.connect(self.db_url) as conn:
+                with conn.cursor() as cur:
+                    cur.execute("""
+                    UPDATE stems SET tempo = %s, musical_key = %s, tuning = %s,
+                        loudness_db = %s, loudness_lufs = %s, true_peak_dbtp = %s, analysis_url = %s
+                    WHERE spotify_track_id = %s
+                    """, (
+                        analysis['tempo'],
+                        analysis['musical_key'],
+                        analysis['tuning'],
+                        analysis['sources']['full_song']['loudness_db'],
+                        analysis['sources']['full_song']['loudness_lufs'],
+                        analysis['sources']['full_song']['true_peak_dbtp'],
+                        analysis_url,
+                        spotify_id,
+                    ))
+                    for source, values in analysis['sources'].items():
+                        cur.execute("""
+                        INSERT INTO track_analysis (
+                            spotify_track_id, source, tempo, tuning, rms_energy, duration, beat_times,
+                            loudness_lufs, true_peak_dbtp
+                        ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                        ON CONFLICT (spotify_track_id, source) DO UPDATE SET
+                            tempo = EXCLUDED.tempo,
+                            tuning = EXCLUDED.tuning,
+                            rms_energy = EXCLUDED.rms_energy,
+                            duration = EXCLUDED.duration,
+                            beat_times = EXCLUDED.beat_times,
+                            loudness_lufs = EXCLUDED.loudness_lufs,
+                            true_peak_dbtp = EXCLUDED.true_peak_dbtp,
+                            analyzed_at = NOW()
+                        """, (
+                            spotify_id,
+                            source,
+                            analysis['tempo'],
+                            analysis['tuning'],
+                            values['rms_energy'],
+                            values['duration'],
+                            analysis['beat_times'],
+                            values['loudness_lufs'],
+                            values['true_peak_dbtp'],
+                        ))
+            logger.info(f"💾 Saved analysis for {spotify_id}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"❌ Analysis save failed for {spotify_id}: {e}")
+            return False
+    
     def cleanup_local_files(self, spotify_id):
         """Clean up local files to save disk space"""
         track_dir = self.output_dir / spotify_id
@@ -262,7 +476,7 @@ class RiddimBatchProcessor:
             logger.debug(f"🗑️  Cleaned up local files for {spotify_id}")
     
     def process_track(self, track_info):
-        """Process a single track: download, separate, upload, save"""
+        """Process a single track: download, separate, analyze, upload, save"""
         spotify_id = track_info['spotify_id']
         rank = track_info['rank']
         
@@ -285,19 +499,25 @@ class RiddimBatchProcessor:
                 self.cleanup_local_files(spotify_id)
                 return False
             
-            # Step 3: Upload to GCS
-            uploaded_urls = self.upload_to_gcs(track_info, audio_file, stem_files)
+            # Step 3: Analyze (beat grid, key, loudness) while the audio is on local disk
+            analysis = self.analyze_track(track_info, audio_file, stem_files)
+            
+            # Step 4: Upload to GCS
+            uploaded_urls = self.upload_to_gcs(track_info, audio_file, stem_files,
+                                               analysis['sidecar_path'] if analysis else None)
             if not uploaded_urls:
                 self.failed_tracks.append({**track_info, 'error': 'GCS upload failed'})
                 self.cleanup_local_files(spotify_id)
                 return False
             
-            # Step 4: Save to database
+            # Step 5: Save to database
             if self.save_to_database(track_info, uploaded_urls, file_size_mb, processing_time):
+                if analysis:
+                    self.save_analysis(spotify_id, analysis, uploaded_urls.get('analysis'))
                 self.processed_tracks.append({**track_info, 'urls': uploaded_urls})
                 logger.info(f"🎉 [{rank:03d}] COMPLETE: {track_info['track_name']}")
                 
-                # Step 5: Cleanup
+                # Step 6: Cleanup
                 self.cleanup_local_files(spotify_id)
                 return True
             else:
@@ -310,6 +530,81 @@ class RiddimBatchProcessor:
             self.cleanup_local_files(spotify_id)
             return False
     
+    def download_url(self, url, dest_path):
+        """Fetch an already-uploaded file back from GCS (backfill only)"""
+        with requests.get(url, stream=True, timeout=(10, 120)) as r:
+            r.raise_for_status()
+            with open(dest_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        return str(dest_path)
+    
+    def backfill_track(self, row):
+        """Analyze one already-processed track from its GCS URLs"""
+        spotify_id = row['spotify_track_id']
+        track_info = {'spotify_id': spotify_id, 'rank': row.get('rank') or 0}
+        track_dir = self.output_dir / spotify_id
+        track_dir.mkdir(exist_ok=True)
+        
+        try:
+            audio_file = self.download_url(row['full_song_url'], track_dir / f"{spotify_id}.mp3")
+            stem_files = {
+                stem: self.download_url(row[f'{stem}_url'], track_dir / f"{stem}.mp3")
+                for stem in STEM_NAMES if row.get(f'{stem}_url')
+            }
+            analysis = self.analyze_track(track_info, audio_file, stem_files)
+            if not analysis:
+                return spotify_id, False, 'Analysis failed'
+            analysis_url = self.upload_analysis(spotify_id, analysis['sidecar_path'])
+            if not self.save_analysis(spotify_id, analysis, analysis_url):
+                return spotify_id, False, 'Database save failed'
+            return spotify_id, True, None
+        except Exception as e:
+            return spotify_id, False, str(e)
+        finally:
+            self.cleanup_local_files(spotify_id)
+    
+    def backfill_analysis(self, workers=None, limit=None):
+        """Analyze every track in `stems` that has no analysis yet, using a process pool"""
+        if not self.db_url:
+            logger.error("No database URL provided")
+            return
+        
+        self.ensure_analysis_schema()
+        with psycopg2.connect(self.db_url, cursor_factory=RealDictCursor) as conn:
+            with conn.cursor() as cur:
+                query = """
+                SELECT spotify_track_id, rank, full_song_url, vocals_url, drums_url, bass_url, other_url
+                FROM stems WHERE (tempo IS NULL OR loudness_lufs IS NULL) AND full_song_url IS NOT NULL
+                ORDER BY rank
+                """
+                if limit:
+                    query += f" LIMIT {int(limit)}"
+                cur.execute(query)
+                rows = [dict(row) for row in cur.fetchall()]
+        
+        workers = workers or os.cpu_count()
+        logger.info(f"🚀 BACKFILLING ANALYSIS for {len(rows)} tracks with {workers} workers")
+        self.processing_stats['start_time'] = datetime.now()
+        
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_backfill_worker,
+                                 initargs=(self.gcs_bucket, self.db_url)) as pool:
+            futures = [pool.submit(_backfill_worker, row) for row in rows]
+            for i, future in enumerate(as_completed(futures), 1):
+                spotify_id, ok, error = future.result()
+                if ok:
+                    self.processing_stats['successful'] += 1
+                else:
+                    self.processing_stats['failed'] += 1
+                    self.failed_tracks.append({'rank': 0, 'track_name': spotify_id, 'error': error})
+                    logger.error(f"❌ Backfill failed: {spotify_id} - {error}")
+                self.processing_stats['total_processed'] += 1
+                logger.info(f"📊 BACKFILL PROGRESS: {i}/{len(rows)}")
+        
+        self.processing_stats['end_time'] = datetime.now()
+        if rows:
+            self.print_summary()
+    
     def process_batch(self, manifest_file, start_rank=1, end_rank=None, batch_size=1000):
         """Process a batch of tracks - DEFAULT: ALL 1000 SONGS"""
         # Load tracks
@@ -336,6 +631,9 @@ class RiddimBatchProcessor:
         
         self.processing_stats['start_time'] = datetime.now()
         
+        if self.db_url:
+            self.ensure_analysis_schema()
+        
         # Process each track
         for i, track in enumerate(tracks, 1):
             logger.info(f"\n📊 BATCH PROGRESS: {i}/{len(tracks)} ({i/len(tracks)*100:.1f}%)")
@@ -370,16 +668,30 @@ class RiddimBatchProcessor:
             for track in self.failed_tracks[:10]:  # Show first 10 failures
                 logger.info(f"   {track['rank']:03d}. {track['track_name']} - {track.get('error', 'Unknown error')}")
 
+_backfill_processor = None
+
+def _init_backfill_worker(gcs_bucket, db_url):
+    global _backfill_processor
+    _backfill_processor = RiddimBatchProcessor(gcs_bucket=gcs_bucket, db_url=db_url)
+
+def _backfill_worker(row):
+    return _backfill_processor.backfill_track(row)
+
 def main():
     parser = argparse.ArgumentParser(description='RIDDIM Batch Processor - Process Afrobeats songs into stems')
-    parser.add_argument('--manifest', required=True, help='Path to manifest JSON file with song data')
+    parser.add_argument('--manifest', help='Path to manifest JSON file with song data')
     parser.add_argument('--start-rank', type=int, default=1, help='Starting rank (default: 1)')
     parser.add_argument('--end-rank', type=int, help='Ending rank (optional, processes to end if not specified)')
     parser.add_argument('--batch-size', type=int, default=1000, help='Batch size (default: 1000 - ALL SONGS)')
     parser.add_argument('--gcs-bucket', default='gs://riddim-stems-timi-1752717149', help='GCS bucket for file storage')
     parser.add_argument('--db-url', help='Database URL (default: from RIDDIM_DATABASE_URL env var)')
+    parser.add_argument('--backfill-analysis', action='store_true', help='Analyze already-processed tracks instead of processing a manifest')
+    parser.add_argument('--workers', type=int, help='Backfill worker processes (default: CPU count)')
+    parser.add_argument('--limit', type=int, help='Maximum number of tracks to backfill')
     
     args = parser.parse_args()
+    if not args.manifest and not args.backfill_analysis:
+        parser.error('--manifest is required unless --backfill-analysis is given')
     
     # Initialize processor
     processor = RiddimBatchProcessor(
@@ -387,6 +699,10 @@ def main():
         db_url=args.db_url
     )
     
+    if args.backfill_analysis:
+        processor.backfill_analysis(workers=args.workers, limit=args.limit)
+        return
+    
     logger.info(f"🚀 RIDDIM BATCH PROCESSOR - PROCESSING {args.batch_size} SONGS")
     logger.info(f"   For FULL 1000 songs: Use default settings")
     logger.info(f"   For testing: Use --batch-size 10")
@@ -17,6 +17,7 @@ cd /home/riddim
 
 # Download processing files from GCS
 gsutil cp gs://riddim-stems-timi-1752717149/riddim_batch_processor.py ./
+gsutil cp gs://riddim-stems-timi-1752717149/loudness.py ./
 gsutil cp gs://riddim-stems-timi-1752717149/afrobeats_intelligence_20250717_103640_manifest.json ./
 
 # Set environment variables